@@ -0,0 +1,67 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from ems.datasets.case import CSVCaseSet
+from ems.datasets.demand import DemandSet
+
+
+def write_cases(filename, rows, rng):
+    """ Writes a synthetic call log with the default CSVCaseSet headers, in random order. """
+    start = datetime(2020, 1, 1)
+    offsets = rng.integers(0, 365 * 24 * 3600 * 10 ** 6, rows)
+    df = pd.DataFrame({"id": np.arange(rows),
+                       "date": (np.datetime64(start, 'us') + offsets.astype('timedelta64[us]')).astype(str),
+                       "latitude": 32.7 + rng.uniform(-0.3, 0.3, rows),
+                       "longitude": -117.1 + rng.uniform(-0.3, 0.3, rows),
+                       "priority": rng.integers(1, 5, rows)})
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    df.to_csv(filename, index=False)
+
+
+def write_demands(filename, rows, rng):
+    df = pd.DataFrame({"latitude": 32.7 + rng.uniform(-0.3, 0.3, rows),
+                       "longitude": -117.1 + rng.uniform(-0.3, 0.3, rows)})
+    df.to_csv(filename, index=False)
+
+
+def time_call(function):
+    t0 = time.perf_counter()
+    function()
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure the time to load cases and demands from CSV files as the number of rows grows.")
+
+    parser.add_argument('--rows',
+                        help="Row counts to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    print("{:>10} {:>12} {:>14} {:>12}".format("rows", "cases (s)", "iterate (s)", "demands (s)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            cases_file = os.path.join(directory, "cases.csv")
+            demands_file = os.path.join(directory, "demands.csv")
+            write_cases(cases_file, rows, rng)
+            write_demands(demands_file, rows, rng)
+
+            case_set = []
+            load_cases = time_call(lambda: case_set.append(CSVCaseSet(cases_file, event_generator=None)))
+            iterate_cases = time_call(lambda: sum(1 for _ in case_set[0].iterator()))
+            load_demands = time_call(lambda: DemandSet(filename=demands_file))
+
+            print("{:>10} {:>12.3f} {:>14.3f} {:>12.3f}".format(rows, load_cases, iterate_cases, load_demands))
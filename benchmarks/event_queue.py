@@ -0,0 +1,54 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from ems.simulators.event_queue import HeapEventQueue, SortedListEventQueue
+
+
+def time_per_event(queue, concurrency, events):
+    """
+    Fills the queue with the given number of concurrent items, then times a steady state of
+    popping the next item and pushing it back with a later time, as the simulator does.
+    :return: Seconds per event
+    """
+
+    start = datetime(2020, 1, 1)
+    for index in range(concurrency):
+        queue.push(start + timedelta(seconds=random.randint(0, 3600)), index)
+
+    t0 = time.perf_counter()
+    current_time = start
+    for _ in range(events):
+        current_time = queue.peek_time()
+        item = queue.pop()
+        queue.push(current_time + timedelta(seconds=random.randint(1, 3600)), item)
+    return (time.perf_counter() - t0) / events
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure the per-event cost of the simulator event queues as the number of "
+                    "concurrent cases grows.")
+
+    parser.add_argument('--events',
+                        help="Number of events to time at each concurrency level.",
+                        type=int,
+                        default=20000)
+
+    parser.add_argument('--concurrency',
+                        help="Concurrency levels to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[10, 100, 1000, 10000, 100000])
+
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    print("{:>12} {:>16} {:>16}".format("concurrency", "heap (us/event)", "sorted (us/event)"))
+    for concurrency in args.concurrency:
+        heap = time_per_event(HeapEventQueue(), concurrency, args.events)
+        sorted_list = time_per_event(SortedListEventQueue(), concurrency, args.events)
+        print("{:>12} {:>16.2f} {:>16.2f}".format(concurrency, heap * 1e6, sorted_list * 1e6))
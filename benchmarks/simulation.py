@@ -0,0 +1,321 @@
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from ems.run import Driver, seed_replication
+from ems.simulators.event_queue import HeapEventQueue
+
+SELECTORS = {"best": "ems.algorithms.ambulance.BestTravelTime",
+             "least": "ems.algorithms.ambulance.LeastDisruption",
+             "optimal": "ems.algorithms.ambulance.OptimalTravelTimeWithCoverage",
+             "random": "ems.algorithms.ambulance.RandomSelector"}
+
+METRICS = {"coverage": "ems.analysis.coverage.PercentCoverage",
+           "double_coverage": "ems.analysis.coverage.PercentDoubleCoverage",
+           "radius_coverage": "ems.analysis.coverage.RadiusCoverage",
+           "pending": "ems.analysis.metric.CountPending",
+           "delay": "ems.analysis.metric.TotalDelay"}
+
+# Measurements where a larger value is better; for the others a smaller value is better
+HIGHER_IS_BETTER = {"events_per_second": True,
+                    "startup_seconds": False,
+                    "peak_rss_mb": False}
+
+CENTER_LATITUDE = 32.7
+CENTER_LONGITUDE = -117.1
+RADIUS_KM = 15
+SPEED_KMH = 40
+
+# Seconds before an ambulance starts driving, so that no travel time is zero
+TURNOUT_SECONDS = 60
+
+# Mean duration of a case in minutes, used to choose the call rate for a target fleet utilization
+MEAN_CASE_MINUTES = 60
+
+
+# Counts the events processed by the simulator
+class CountingEventQueue(HeapEventQueue):
+
+    def __init__(self):
+        super().__init__()
+        self.popped = 0
+
+    def pop(self):
+        self.popped += 1
+        return super().pop()
+
+
+def synthetic_data(demands, rng):
+    """
+    Generates demand points uniformly within a circle and a travel time matrix between them,
+    proportional to the distance with some noise plus a turnout time.
+    :return: The demand latitudes, longitudes and the travel times in seconds
+    """
+
+    direction = rng.uniform(0, 2 * np.pi, demands)
+    magnitude = RADIUS_KM / 110.54 * np.sqrt(rng.uniform(0, 1, demands))
+    latitudes = CENTER_LATITUDE + magnitude * np.sin(direction)
+    longitudes = CENTER_LONGITUDE + magnitude * np.cos(direction)
+
+    # Equirectangular distance in km
+    x = np.radians(longitudes) * np.cos(np.radians(CENTER_LATITUDE))
+    y = np.radians(latitudes)
+    distances = 6371 * np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+
+    noise = rng.uniform(1, 1.5, (demands, demands))
+    times = (TURNOUT_SECONDS + distances / SPEED_KMH * 3600 * noise).astype(np.int32)
+
+    return latitudes, longitudes, times
+
+
+def configuration(fleet, demands, cases, selector, metrics, utilization, seed):
+    """
+    Builds the parameters of a simulation over synthetic data in the format read by the Driver.
+    :return: The parameters
+    """
+
+    rng = np.random.default_rng(seed)
+    latitudes, longitudes, times = synthetic_data(demands, rng)
+    bases = rng.choice(demands, min(fleet, demands), replace=False)
+    hospitals = rng.choice(demands, 10, replace=False)
+
+    ambulance_selector = {"class": SELECTORS[selector]}
+    if selector != "random":
+        ambulance_selector["travel_times"] = "$travel_times"
+    if selector in ("least", "optimal"):
+        ambulance_selector["demands"] = "$demands"
+
+    metric_params = [{"class": METRICS[metric]} for metric in metrics]
+    for metric in metric_params:
+        if "coverage" in metric["class"].lower():
+            metric.update({"demands": "$demands", "travel_times": "$travel_times"})
+
+    return {
+        "demands": {"class": "ems.datasets.location.LocationSet",
+                    "latitudes": latitudes, "longitudes": longitudes},
+        "bases": {"class": "ems.datasets.location.LocationSet",
+                  "latitudes": latitudes[bases], "longitudes": longitudes[bases]},
+        "hospitals": {"class": "ems.datasets.location.LocationSet",
+                      "latitudes": latitudes[hospitals], "longitudes": longitudes[hospitals]},
+        "travel_times": {"class": "ems.datasets.times.TravelTimes",
+                         "origins": "$demands", "destinations": "$demands", "times": times},
+        "ambulances": {"class": "ems.datasets.ambulance.BaseSelectedAmbulanceSet",
+                       "count": fleet,
+                       "base_selector": {"class": "ems.algorithms.base.RoundRobinBaseSelector",
+                                         "base_set": "$bases"}},
+        "cases": {"class": "ems.datasets.case.RandomCaseSet",
+                  "time": datetime(2020, 1, 1),
+                  "case_time_generator": {"class": "ems.generators.duration.PoissonDurationGenerator",
+                                          "lmda": utilization * fleet / MEAN_CASE_MINUTES},
+                  "case_location_generator": {"class": "ems.generators.location.CircleLocationGenerator",
+                                              "center_latitude": CENTER_LATITUDE,
+                                              "center_longitude": CENTER_LONGITUDE,
+                                              "radius_km": RADIUS_KM},
+                  "event_generator": {"class": "ems.generators.event.EventGenerator",
+                                      "travel_duration_generator": {
+                                          "class": "ems.generators.duration.TravelTimeDurationGenerator",
+                                          "travel_times": "$travel_times",
+                                          "epsilon": 0.1},
+                                      "incident_duration_generator": {
+                                          "class": "ems.generators.duration.RandomDurationGenerator"},
+                                      "hospital_duration_generator": {
+                                          "class": "ems.generators.duration.RandomDurationGenerator"},
+                                      "hospital_selector": {
+                                          "class": "ems.algorithms.hospital.FastestHospitalSelector",
+                                          "hospital_set": "$hospitals",
+                                          "travel_times": "$travel_times"}},
+                  "quantity": cases},
+        "simulator": {"class": "ems.simulators.simulator.EventDispatcherSimulator",
+                      "ambulances": "$ambulances",
+                      "cases": "$cases",
+                      "ambulance_selector": ambulance_selector,
+                      "metric_aggregator": {"class": "ems.analysis.metric.MetricAggregator",
+                                            "metrics": metric_params}}}
+
+
+def peak_rss_mb():
+    # Linux reports the maximum resident set size in kilobytes, macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_benchmark(fleet, demands, cases, selector, metrics, utilization, seed):
+    """
+    Runs one simulation end to end. Meant to run in a fresh process so that the peak RSS is its own.
+    :return: The measurements
+    """
+
+    params = configuration(fleet, demands, cases, selector, metrics, utilization, seed)
+    params["simulator"]["event_queue"] = CountingEventQueue()
+
+    seed_replication(seed)
+
+    t0 = time.perf_counter()
+    sim, data = Driver(**params).create_simulator()
+    startup_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    case_record_set = sim.run()
+    run_seconds = time.perf_counter() - t0
+
+    # Every case arrival and every finished event is one simulator event
+    events = len(case_record_set) + sim.event_queue.popped
+
+    return {"fleet": fleet,
+            "demands": demands,
+            "cases": cases,
+            "selector": selector,
+            "startup_seconds": startup_seconds,
+            "run_seconds": run_seconds,
+            "events": events,
+            "events_per_second": events / run_seconds,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def run_isolated(args):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_benchmark, args)
+
+
+def key(result):
+    return result["selector"], result["fleet"], result["demands"], result["cases"]
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares each measurement against the baseline run of the same configuration.
+    :param threshold: The relative change in the wrong direction that counts as a regression
+    :return: The regressions as (configuration, measurement, baseline value, value, relative change)
+    """
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+
+    regressions = []
+    for result in results:
+        if key(result) not in baseline_results:
+            continue
+
+        for measurement, higher_is_better in HIGHER_IS_BETTER.items():
+            old = baseline_results[key(result)][measurement]
+            new = result[measurement]
+            change = (new - old) / old if old else 0.0
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((key(result), measurement, old, new, change))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run the simulator end to end over a grid of fleet sizes, demand set sizes, case counts and "
+                    "ambulance selectors. Records events per second, startup time and peak RSS and compares "
+                    "them against a baseline.")
+
+    parser.add_argument('--fleets',
+                        help="Fleet sizes to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[10, 50])
+
+    parser.add_argument('--demands',
+                        help="Demand set sizes to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[500, 2000])
+
+    parser.add_argument('--cases',
+                        help="Case counts to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[1000, 5000])
+
+    parser.add_argument('--selectors',
+                        help="Ambulance selectors to measure.",
+                        choices=sorted(SELECTORS),
+                        nargs='+',
+                        default=["best", "least", "optimal", "random"])
+
+    parser.add_argument('--metrics',
+                        help="Metrics computed during each simulation.",
+                        choices=sorted(METRICS),
+                        nargs='+',
+                        default=["double_coverage", "pending", "delay"])
+
+    parser.add_argument('--utilization',
+                        help="Target fraction of the fleet busy on average, which sets the call rate.",
+                        type=float,
+                        default=0.7)
+
+    parser.add_argument('--repeat',
+                        help="Runs of each configuration; the fastest run is kept.",
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--seed',
+                        help="Seed of the synthetic data and of the simulation.",
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--output',
+                        help="JSON file the results are written to.",
+                        type=str,
+                        default="benchmark_results.json")
+
+    parser.add_argument('--baseline',
+                        help="JSON results of a previous run to compare against.",
+                        type=str,
+                        default=None)
+
+    parser.add_argument('--threshold',
+                        help="Relative change against the baseline that counts as a regression.",
+                        type=float,
+                        default=0.1)
+
+    args = parser.parse_args()
+
+    print("{:>9} {:>6} {:>8} {:>7} {:>12} {:>10} {:>10} {:>10}".format(
+        "selector", "fleet", "demands", "cases", "startup (s)", "run (s)", "events/s", "RSS (MB)"))
+
+    results = []
+    for selector, fleet, demands, cases in itertools.product(args.selectors, args.fleets, args.demands, args.cases):
+        runs = [run_isolated((fleet, demands, cases, selector, args.metrics, args.utilization, args.seed))
+                for _ in range(args.repeat)]
+        result = min(runs, key=lambda run: run["run_seconds"])
+        results.append(result)
+
+        print("{:>9} {:>6} {:>8} {:>7} {:>12.3f} {:>10.3f} {:>10.0f} {:>10.1f}".format(
+            selector, fleet, demands, cases, result["startup_seconds"], result["run_seconds"],
+            result["events_per_second"], result["peak_rss_mb"]))
+
+    with open(args.output, 'w') as f:
+        json.dump({"created": datetime.now().isoformat(),
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "machine": platform.platform(),
+                   "metrics": args.metrics,
+                   "utilization": args.utilization,
+                   "seed": args.seed,
+                   "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        for configuration_key, measurement, old, new, change in regressions:
+            print("Regression in {} for {}: {:.3f} -> {:.3f} ({:+.1%})".format(
+                measurement, configuration_key, old, new, change))
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions beyond {:.0%} against {}".format(args.threshold, args.baseline))
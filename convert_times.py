@@ -0,0 +1,38 @@
+from ems.datasets.location import LocationSet
+from ems.datasets.times import convert_times_csv
+from ems.utils import parse_coordinates_csv
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert a CSV matrix of travel times into the binary format that TravelTimes "
+                    "opens as a memory map.")
+
+    parser.add_argument('csv_file',
+                        help="Headerless CSV with one row per origin and one column per destination.",
+                        type=str)
+
+    parser.add_argument('binary_file',
+                        help="The binary travel times file to write.",
+                        type=str)
+
+    parser.add_argument('--origins',
+                        help="CSV of origin latitudes and longitudes, checked when the file is opened.",
+                        type=str,
+                        default=None)
+
+    parser.add_argument('--destinations',
+                        help="CSV of destination latitudes and longitudes, checked when the file is opened.",
+                        type=str,
+                        default=None)
+
+    # parse arguments
+    args = parser.parse_args()
+
+    origins = LocationSet(*parse_coordinates_csv(args.origins)) if args.origins else None
+    destinations = LocationSet(*parse_coordinates_csv(args.destinations)) if args.destinations else None
+
+    shape = convert_times_csv(args.csv_file, args.binary_file, origins, destinations)
+    print("Converted {}x{} travel times".format(*shape))
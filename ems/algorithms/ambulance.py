@@ -4,6 +4,8 @@ from datetime import timedelta
 from itertools import combinations
 from typing import List
 
+import numpy as np
+
 from ems.analysis.coverage import PercentDoubleCoverage
 from ems.datasets.times import TravelTimes
 from ems.models.ambulance import Ambulance
@@ -37,13 +39,12 @@ class BestTravelTime(AmbulanceSelector):
                          case: Case,
                          current_time: datetime):
 
-        # Compute the closest demand point to the case location
-        loc_set_2 = self.travel_times.destinations
-        closest_loc_to_case, _, _ = loc_set_2.closest(case.incident_location)
+        # Compute the index of the closest demand point to the case location
+        case_index = case.incident_location_index(self.travel_times.destinations)
 
         # Select an ambulance to attend to the given case and obtain the its duration of travel
-        chosen_ambulance, ambulance_travel_time = self.find_fastest_ambulance(
-            available_ambulances, closest_loc_to_case)
+        chosen_ambulance, ambulance_travel_time = self.find_fastest_ambulance_by_index(
+            available_ambulances, case_index)
 
         return chosen_ambulance
 
@@ -56,29 +57,33 @@ class BestTravelTime(AmbulanceSelector):
         :return: The ambulance and the travel time
         """
 
-        shortest_time = timedelta.max
-        fastest_amb = None
-
-        loc_set_1 = self.travel_times.origins
+        _, case_index, case_distance = self.travel_times.destinations.closest(closest_loc_to_case)
+        if case_distance > 0:
+            raise Exception("Location 2 does not exist in location set 2")
 
-        for amb in ambulances:
+        return self.find_fastest_ambulance_by_index(ambulances, case_index)
 
-            # Compute closest location in the first set to the ambulance
-            ambulance_location = amb.location
+    def find_fastest_ambulance_by_index(self, ambulances, case_index):
+        """
+        Finds the ambulance with the shortest one way travel time from its location to the
+        demand point with the given index in the destination set
+        :param ambulances:
+        :param case_index:
+        :return: The ambulance and the travel time
+        """
 
-            # Compute closest location in location set 1 to the ambulance location
-            closest_loc_to_ambulance = loc_set_1.closest(ambulance_location)[0]
+        if not ambulances:
+            return None, None
 
-            # Compute the time from the location point mapped to the ambulance to the location point mapped to the case
-            time = self.travel_times.get_time(closest_loc_to_ambulance, closest_loc_to_case)
-            if shortest_time > time:
-                shortest_time = time
-                fastest_amb = amb
+        # Compute the time from the location point mapped to each ambulance to the location point mapped to the case
+        loc_set_1 = self.travel_times.origins
+        ambulance_indices = [amb.location_index(loc_set_1) for amb in ambulances]
+        times = self.travel_times.get_times_to_index(case_index, ambulance_indices)
 
-        if fastest_amb is not None:
-            return fastest_amb, shortest_time
+        # Ties go to the first ambulance
+        fastest_index = int(np.argmin(times))
 
-        return None, None
+        return ambulances[fastest_index], timedelta(seconds=int(times[fastest_index]))
 
 
 # An implementation of a "fastest travel time" ambulance_selection from a base to
@@ -90,8 +95,10 @@ class LeastDisruption(BestTravelTime):
                  demands=None,
                  r1=600,
                  r2=840,
+                 marginal_coverage: bool = True,
                  ):
         self.travel_times = travel_times
+        self.marginal_coverage = marginal_coverage
         # self.coverage = PercentCoverage(
         # demands=demands,
         # travel_times=self.travel_times,
@@ -125,6 +132,9 @@ class LeastDisruption(BestTravelTime):
         :return: The ambulance and the travel time
         """
 
+        if self.marginal_coverage:
+            return self.find_least_marginal_disruption(ambulances)
+
         # Calculate all combinations of ambulances's coverage and return the best one.
 
         chosen_ambulance_set = []
@@ -156,6 +166,31 @@ class LeastDisruption(BestTravelTime):
 
         return chosen_ambulance, None
 
+    def find_least_marginal_disruption(self, ambulances):
+        """
+        Finds the ambulance whose dispatch loses the least coverage, computing the coverage
+        without each ambulance from the per-demand coverage counts in one pass
+        :param ambulances:
+        :return: The ambulance and the travel time
+        """
+
+        coverages = self.coverage.calculate_without_each(ambulances)
+
+        chosen_ambulance = None
+        current_primary = -1
+        current_secondary = -1
+
+        # Visit the ambulances in the order combinations() leaves them out so that ties are broken as before
+        for ambulance, (primary, secondary) in reversed(list(zip(ambulances, coverages))):
+
+            # Primary coverage considered first. In the event of a tie, consider the larger of the secondaries.
+            if primary > current_primary or (primary == current_primary and secondary > current_secondary):
+                current_primary = primary
+                current_secondary = secondary
+                chosen_ambulance = ambulance
+
+        return chosen_ambulance, None
+
 
 # An implementation of a "fastest travel time" ambulance_selection from a base
 # to the demand point closest to a case
@@ -166,9 +201,11 @@ class OptimalTravelTimeWithCoverage(AmbulanceSelector):
                  demands=None,
                  r1=600,
                  r2=840,
+                 marginal_coverage: bool = True,
                  ):
 
         self.travel_times = travel_times
+        self.marginal_coverage = marginal_coverage
         # This instance is used for calculating future coverages
 
         self.coverage = PercentDoubleCoverage(
@@ -193,10 +230,9 @@ class OptimalTravelTimeWithCoverage(AmbulanceSelector):
             print("WARNING: Case priority was not found but optimal dispatching requires it. ")
 
         # Optimization: if priority is 1, send fastest ambulance. If it's 4, send best coverage.
-        loc_set_2 = self.travel_times.destinations
-        closest_loc_to_case, _, _ = loc_set_2.closest(case.incident_location)
+        case_index = case.incident_location_index(self.travel_times.destinations)
 
-        times = self.sort_ambulances_by_traveltime(available_ambulances, closest_loc_to_case)
+        times = self.sort_ambulances_by_traveltime_by_index(available_ambulances, case_index)
         coverages = self.sort_ambulances_by_coverage(available_ambulances)
 
         # As times increase, it is less favorable than the fastest time. For example,
@@ -260,23 +296,27 @@ class OptimalTravelTimeWithCoverage(AmbulanceSelector):
         :return: The ambulance and the travel time
         """
 
-        loc_set_1 = self.travel_times.origins
-
-        list_of_ambulances = []
+        _, case_index, case_distance = self.travel_times.destinations.closest(closest_loc_to_case)
+        if case_distance > 0:
+            raise Exception("Location 2 does not exist in location set 2")
 
-        for amb in ambulances:
-            # Compute closest location in the first set to the ambulance
-            ambulance_location = amb.location
+        return self.sort_ambulances_by_traveltime_by_index(ambulances, case_index)
 
-            # Compute closest location in location set 1 to the ambulance location
-            closest_loc_to_ambulance = loc_set_1.closest(ambulance_location)[0]
+    def sort_ambulances_by_traveltime_by_index(self, ambulances, case_index):
+        """
+        Sorts the ambulances by their one way travel time to the demand point with the given
+        index in the destination set
+        :param ambulances:
+        :param case_index:
+        :return: A list of travel time and ambulance pairs
+        """
 
-            # Compute the time from the location point mapped to the ambulance to the location point mapped to the case
-            time = self.travel_times.get_time(closest_loc_to_ambulance, closest_loc_to_case)
+        # Compute the time from the location point mapped to each ambulance to the location point mapped to the case
+        loc_set_1 = self.travel_times.origins
+        ambulance_indices = [amb.location_index(loc_set_1) for amb in ambulances]
+        times = self.travel_times.get_times_to_index(case_index, ambulance_indices)
 
-            list_of_ambulances.append(
-                (time, amb)
-            )
+        list_of_ambulances = [(timedelta(seconds=int(time)), amb) for time, amb in zip(times, ambulances)]
 
         # Sort by the travel time.
         list_of_ambulances.sort(key=lambda t: t[0])
@@ -287,6 +327,16 @@ class OptimalTravelTimeWithCoverage(AmbulanceSelector):
     def sort_ambulances_by_coverage(self, ambulances):
         """ Calculate all combinations of ambulances's coverage and return the best one. """
 
+        if self.marginal_coverage:
+            coverages = self.coverage.calculate_without_each(ambulances)
+
+            # List the ambulances in the order combinations() leaves them out so that the sort breaks ties as before
+            list_of_ambulances = list(reversed(list(zip(coverages, ambulances))))
+            list_of_ambulances.sort(key=lambda t: t[0])
+            list_of_ambulances.reverse()
+
+            return list_of_ambulances
+
         potential_ambulances = list(combinations(ambulances, len(ambulances) - 1))
         list_of_ambulances = []
 
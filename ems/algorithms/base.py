@@ -1,4 +1,13 @@
+import itertools
+import time
+from typing import List
+
+import numpy as np
+
+from ems.algorithms.coverage import GreedyMaxCoverage, pack_coverage
+from ems.analysis.coverage import snap_demands
 from ems.datasets.location import LocationSet
+from ems.datasets.times import TravelTimes
 
 
 class AmbulanceBaseSelector:
@@ -23,3 +32,255 @@ class RoundRobinBaseSelector(AmbulanceBaseSelector):
             bases.append(self.base_set.locations[base_index])
 
         return bases
+
+
+# Refines a set of bases, chosen among the candidate sites of a travel times matrix, by local search. A move takes
+# one chosen base out and puts an unchosen candidate in: relocations to the nearest candidates of the base are
+# tried first, then swaps with every other candidate, most covering first. The first move that improves the
+# primary coverage, or the secondary coverage at equal primary coverage, is applied, until no move improves or
+# the time budget runs out.
+#
+# The number of chosen bases within r1 and within r2 of each demand is kept, so that a move is scored from the
+# demands within reach of the two bases it changes only, instead of recounting the coverage of every demand.
+class LocalSearchBaseOptimizer:
+
+    def __init__(self,
+                 times,
+                 demand_indices=None,
+                 r1: float = 600,
+                 r2: float = 840,
+                 neighbours=None):
+        """
+        :param times: Travel times from each candidate base (rows) to each demand location (columns)
+        :param demand_indices: Column of each demand; one demand per column if None
+        :param r1: A demand has primary coverage from a base with a travel time strictly less than r1
+        :param r2: A demand has secondary coverage from a second base with a travel time strictly less than r2
+        :param neighbours: Candidates to relocate each base to first, as one sequence of indices per candidate
+        """
+
+        times = np.asarray(times)
+        if demand_indices is None:
+            demand_indices = np.arange(times.shape[1])
+
+        self.r1 = r1
+        self.r2 = r2
+        self.demand_count = len(demand_indices)
+
+        # Demands within r1 and within r2 of each candidate, as sorted indices
+        self.primary_demands = [np.flatnonzero(times[candidate, demand_indices] < r1)
+                                for candidate in range(len(times))]
+        self.secondary_demands = [np.flatnonzero(times[candidate, demand_indices] < r2)
+                                  for candidate in range(len(times))]
+
+        self.neighbours = neighbours if neighbours is not None else [[] for _ in range(len(times))]
+
+        # Swap candidates, the ones covering the most demands first
+        self.swap_order = sorted(range(len(times)),
+                                 key=lambda candidate: (-len(self.primary_demands[candidate]),
+                                                        -len(self.secondary_demands[candidate])))
+
+        self.chosen = []
+        self.is_chosen = np.zeros(len(times), dtype=bool)
+        self.primary_counts = np.zeros(self.demand_count, dtype=int)
+        self.secondary_counts = np.zeros(self.demand_count, dtype=int)
+
+    def reset(self, bases: List[int]):
+        """
+        Makes the given candidates the chosen bases.
+        :param bases: Distinct candidate indices
+        """
+
+        if len(set(bases)) != len(bases):
+            raise Exception("The bases to optimize must be distinct")
+
+        self.chosen = list(bases)
+        self.is_chosen[:] = False
+        self.is_chosen[self.chosen] = True
+
+        self.primary_counts[:] = 0
+        self.secondary_counts[:] = 0
+        for base in self.chosen:
+            self.primary_counts[self.primary_demands[base]] += 1
+            self.secondary_counts[self.secondary_demands[base]] += 1
+
+    def count_covered(self, primary_counts, secondary_counts):
+        """
+        Counts the demands with primary coverage, and those that also have secondary coverage: a demand covered
+        by one base within r1 and by a different base within r2, as in PercentDoubleCoverage.
+        :return: The numbers of demands with primary and with secondary coverage
+        """
+
+        if self.r1 <= self.r2:
+            secondary = (primary_counts > 0) & (secondary_counts > 1)
+        else:
+            secondary = (primary_counts > 1) & (secondary_counts > 0)
+
+        return int(np.count_nonzero(primary_counts)), int(np.count_nonzero(secondary))
+
+    def coverage(self):
+        """ :return: The numbers of demands with primary and with secondary coverage from the chosen bases """
+        return self.count_covered(self.primary_counts, self.secondary_counts)
+
+    def gain(self, base_out: int, base_in: int):
+        """
+        Scores the move of taking a chosen base out and putting a candidate in, from the affected demands only.
+        :return: The changes of the primary and the secondary coverage
+        """
+
+        # Demands within r1 of a base are also within r2 when r1 <= r2
+        if self.r1 <= self.r2:
+            affected = np.union1d(self.secondary_demands[base_out], self.secondary_demands[base_in])
+        else:
+            affected = np.union1d(self.primary_demands[base_out], self.primary_demands[base_in])
+
+        primary_before = self.primary_counts[affected]
+        secondary_before = self.secondary_counts[affected]
+
+        # The coverage lists are sorted subsets of the affected demands
+        primary_after = primary_before.copy()
+        primary_after[np.searchsorted(affected, self.primary_demands[base_out])] -= 1
+        primary_after[np.searchsorted(affected, self.primary_demands[base_in])] += 1
+
+        secondary_after = secondary_before.copy()
+        secondary_after[np.searchsorted(affected, self.secondary_demands[base_out])] -= 1
+        secondary_after[np.searchsorted(affected, self.secondary_demands[base_in])] += 1
+
+        primary_before, secondary_before = self.count_covered(primary_before, secondary_before)
+        primary_after, secondary_after = self.count_covered(primary_after, secondary_after)
+
+        return primary_after - primary_before, secondary_after - secondary_before
+
+    def move(self, position: int, base_in: int):
+        """
+        Replaces a chosen base.
+        :param position: Position of the base in the chosen bases
+        :param base_in: The candidate that replaces it
+        """
+
+        base_out = self.chosen[position]
+
+        self.primary_counts[self.primary_demands[base_out]] -= 1
+        self.secondary_counts[self.secondary_demands[base_out]] -= 1
+        self.primary_counts[self.primary_demands[base_in]] += 1
+        self.secondary_counts[self.secondary_demands[base_in]] += 1
+
+        self.is_chosen[base_out] = False
+        self.is_chosen[base_in] = True
+        self.chosen[position] = base_in
+
+    def optimize(self, bases: List[int], time_limit: float = None):
+        """
+        Refines a set of bases until no move improves the coverage or the time budget runs out.
+        :param bases: Distinct candidate indices to start from
+        :param time_limit: Wall clock budget in seconds; no limit if None
+        :return: The chosen candidate indices, in the positions of the bases they replaced
+        """
+
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.reset(bases)
+
+        # No move improves once every demand has primary and secondary coverage
+        full_coverage = (self.demand_count, self.demand_count)
+
+        improved = True
+        while improved and self.coverage() != full_coverage:
+            improved = False
+
+            for position in range(len(self.chosen)):
+                base_out = self.chosen[position]
+
+                for base_in in itertools.chain(self.neighbours[base_out], self.swap_order):
+
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return list(self.chosen)
+
+                    if self.is_chosen[base_in]:
+                        continue
+
+                    if self.gain(base_out, base_in) > (0, 0):
+                        self.move(position, base_in)
+                        improved = True
+                        break
+
+                if self.coverage() == full_coverage:
+                    break
+
+        return list(self.chosen)
+
+
+class LocalSearchBaseSelector(AmbulanceBaseSelector):
+    """
+    Places ambulances at the origins of a travel times matrix chosen to maximize the primary, then the secondary,
+    coverage of the demands. The bases of an initial selector, or the greedy maximum coverage bases, are refined
+    by a LocalSearchBaseOptimizer. Once every origin has an ambulance, the remaining ambulances are placed in
+    round robin order.
+    """
+
+    def __init__(self,
+                 travel_times: TravelTimes,
+                 demands: LocationSet = None,
+                 r1: int = 600,
+                 r2: int = 840,
+                 initial_selector: AmbulanceBaseSelector = None,
+                 neighbours: int = 8,
+                 time_limit: float = None):
+        """
+        :param travel_times:
+        :param demands: Demands to cover, snapped to the destinations; every destination once if None
+        :param r1: Primary coverage radius in seconds
+        :param r2: Secondary coverage radius in seconds
+        :param initial_selector: Selects the bases to start from; the greedy maximum coverage bases if None
+        :param neighbours: Number of nearest origins each base is relocated to before trying swaps
+        :param time_limit: Wall clock budget of the search in seconds; no limit if None
+        """
+        self.travel_times = travel_times
+        self.demands = demands
+        self.initial_selector = initial_selector
+        self.time_limit = time_limit
+
+        origins = travel_times.origins
+        self.demand_indices = None if demands is None else snap_demands(demands, travel_times)
+
+        # The nearest origins of each origin, itself excluded
+        latitudes = [location.latitude for location in origins]
+        longitudes = [location.longitude for location in origins]
+        nearest, _ = origins.k_nearest(latitudes, longitudes, neighbours + 1)
+        self.neighbours = [[int(candidate) for candidate in row if candidate != index]
+                           for index, row in enumerate(nearest)]
+
+        self.optimizer = LocalSearchBaseOptimizer(travel_times.times,
+                                                  demand_indices=self.demand_indices,
+                                                  r1=r1,
+                                                  r2=r2,
+                                                  neighbours=self.neighbours)
+
+    def initial_bases(self, count: int):
+        """ :return: The distinct origin indices to start the search from """
+
+        if self.initial_selector is not None:
+            locations = self.initial_selector.select(count)
+            indices, _ = self.travel_times.origins.closest_many([location.latitude for location in locations],
+                                                               [location.longitude for location in locations])
+        else:
+            times = np.asarray(self.travel_times.times)
+            if self.demand_indices is not None:
+                times = times[:, self.demand_indices]
+            _, indices = GreedyMaxCoverage(pack_coverage(times, self.optimizer.r1), count).from_start(0)
+
+        # Greedy bases repeat once every demand is covered: complete with the most covering unused origins
+        bases = list(dict.fromkeys(int(index) for index in indices))
+        for candidate in self.optimizer.swap_order:
+            if len(bases) == count:
+                break
+            if candidate not in bases:
+                bases.append(candidate)
+
+        return bases
+
+    def select(self, num_ambulances):
+        origins = self.travel_times.origins
+
+        bases = self.optimizer.optimize(self.initial_bases(min(num_ambulances, len(origins))),
+                                        time_limit=self.time_limit)
+
+        return [origins.locations[bases[index % len(bases)]] for index in range(num_ambulances)]
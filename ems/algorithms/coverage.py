@@ -0,0 +1,143 @@
+from multiprocessing import cpu_count, Pool
+
+import numpy as np
+
+# Number of set bits in each byte
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+    def popcount(array):
+        return POPCOUNT_TABLE[array]
+
+
+def pack_coverage(times, radius):
+    """
+    Builds the coverage matrix of a travel times matrix, packed 8 demands per byte.
+    :param times: Travel times from each base (rows) to each demand (columns)
+    :param radius: A demand is covered by a base when the travel time is strictly less than the radius
+    :return: Array of bytes of shape (bases, ceil(demands / 8))
+    """
+    return np.packbits(np.asarray(times) < radius, axis=1)
+
+
+# Greedy maximum coverage over a packed coverage matrix. Each step chooses the base covering the most demands not
+# covered yet; ties go to the base with the highest index. The counts of uncovered demands of every base are kept
+# and only the bytes of the demands covered by the chosen base are visited to update them, instead of masking
+# and counting the whole matrix again. A search is started from each of the best first bases.
+class GreedyMaxCoverage:
+
+    def __init__(self, packed, count: int):
+        """
+        :param packed: Coverage matrix, as returned by pack_coverage
+        :param count: Number of bases to choose
+        """
+        self.packed = packed
+        self.count = count
+
+        # Demands covered by each base, and the bases ranked by coverage, best first
+        self.counts = popcount(packed).sum(axis=1, dtype=np.int64)
+        self.ranking = np.lexsort((np.arange(len(self.counts)), self.counts))[::-1]
+
+    def from_start(self, start: int):
+        """
+        Runs the greedy search with the start-th best base as the first choice.
+        :param start:
+        :return: The number of covered demands and the indices of the chosen bases, in the order chosen
+        """
+
+        counts = self.counts.copy()
+        uncovered = np.full(self.packed.shape[1], 0xFF, dtype=np.uint8)
+
+        chosen_bases = []
+        covered = 0
+        base = int(self.ranking[start])
+
+        for step in range(self.count):
+
+            if step > 0:
+                base = len(counts) - 1 - int(np.argmax(counts[::-1]))
+
+            chosen_bases.append(base)
+            covered += int(counts[base])
+
+            # Mask the newly covered demands and uncount them from the bases that cover them
+            newly_covered = self.packed[base] & uncovered
+            columns = np.flatnonzero(newly_covered)
+            if len(columns):
+                uncovered[columns] &= ~newly_covered[columns]
+                counts -= popcount(self.packed[:, columns] & newly_covered[columns]).sum(axis=1, dtype=np.int64)
+
+        return covered, chosen_bases
+
+    def run(self, starts: int = None, processes: int = None):
+        """
+        Runs the greedy search from each of the best first bases.
+        :param starts: Number of first bases tried; every base if None
+        :param processes: Number of worker processes; the number of CPUs if None. Workers read the coverage
+        matrix from shared memory.
+        :return: The result of from_start for each start
+        """
+
+        starts = len(self.ranking) if starts is None else min(starts, len(self.ranking))
+        processes = cpu_count() if processes is None else processes
+
+        if processes <= 1 or starts <= 1:
+            return [self.from_start(start) for start in range(starts)]
+
+        # Python 3.8+: only the parallel search needs shared memory
+        from multiprocessing import shared_memory
+
+        memory = shared_memory.SharedMemory(create=True, size=max(self.packed.nbytes, 1))
+        shared = np.ndarray(self.packed.shape, dtype=np.uint8, buffer=memory.buf)
+        try:
+            shared[:] = self.packed
+
+            with Pool(min(processes, starts), initializer=attach_coverage,
+                      initargs=(memory.name, self.packed.shape, self.count)) as p:
+                return p.map(greedy_from_start, range(starts))
+
+        finally:
+            del shared
+            memory.close()
+            memory.unlink()
+
+
+def secondary_coverage(times, chosen_bases, r1, r2):
+    """
+    Counts the demands within r1 of a set of bases that have a backup within r2: all of them but those whose only
+    base within r2 is the one at the best primary time.
+    :param times: Travel times from each base (rows) to each demand (columns)
+    :param chosen_bases: Indices of the chosen bases
+    :return: The number of secondarily covered demands
+    """
+
+    rows = np.asarray(times)[np.unique(chosen_bases)]
+
+    primary_times = np.where(rows <= r1, rows, np.inf).min(axis=0)
+    within_r2 = rows <= r2
+    secondary_times = np.where(within_r2, rows, np.inf).min(axis=0)
+
+    # Not a backup when the only base within r2 is the one at the best primary time
+    only_primary = (within_r2.sum(axis=0) == 1) & (secondary_times == primary_times)
+
+    return int(np.count_nonzero(np.isfinite(primary_times) & ~only_primary))
+
+
+# Search attached by each worker process to the coverage matrix in shared memory
+_worker_memory = None
+_worker_coverage = None
+
+
+def attach_coverage(name, shape, count):
+    global _worker_memory, _worker_coverage
+    from multiprocessing import shared_memory
+
+    _worker_memory = shared_memory.SharedMemory(name=name)
+    packed = np.ndarray(shape, dtype=np.uint8, buffer=_worker_memory.buf)
+    _worker_coverage = GreedyMaxCoverage(packed, count)
+
+
+def greedy_from_start(start):
+    return _worker_coverage.from_start(start)
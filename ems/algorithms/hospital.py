@@ -2,6 +2,8 @@ import random
 from datetime import datetime
 from datetime import timedelta
 
+import numpy as np
+
 from ems.datasets.location import LocationSet
 from ems.datasets.times import TravelTimes
 from ems.models.ambulance import Ambulance
@@ -32,37 +34,65 @@ class FastestHospitalSelector(HospitalSelector):
         self.hospital_set = hospital_set
         self.travel_times = travel_times
 
+        # Hospitals do not move: compute the closest location in location set 2 to each hospital once
+        loc_set_2 = self.travel_times.destinations
+        self.hospital_indices, _ = loc_set_2.closest_many(
+            [hospital_location.latitude for hospital_location in self.hospital_set.locations],
+            [hospital_location.longitude for hospital_location in self.hospital_set.locations])
+
+        # The fastest hospital only depends on the origin: precompute it for every location in location set 1.
+        # Times are truncated to whole seconds as by get_time_by_index, and ties go to the first hospital
+        self.hospital_times = np.asarray(self.travel_times.times[:, self.hospital_indices]).astype(int)
+        self.fastest_hospitals = np.argmin(self.hospital_times, axis=1)
+        self.fastest_times = self.hospital_times[np.arange(len(self.hospital_times)), self.fastest_hospitals]
+
     def select(self,
                timestamp: datetime,
                ambulance: Ambulance):
 
-        # Compute the closest point in set 2 to the ambulance
-        loc_set_1 = self.travel_times.origins
-        closest_loc_to_ambulance, _, _ = loc_set_1.closest(ambulance.location)
+        # Compute the index of the closest point in set 1 to the ambulance
+        ambulance_index = ambulance.location_index(self.travel_times.origins)
 
-        # Select an ambulance to attend to the given case and obtain the its duration of travel
-        chosen_hospital, travel_time = self.find_fastest_hospital(closest_loc_to_ambulance)
+        return self.hospital_set.locations[self.fastest_hospitals[ambulance_index]]
 
-        return chosen_hospital
+    def select_fastest(self,
+                       timestamp: datetime,
+                       ambulance: Ambulance,
+                       k: int):
+        """
+        Selects the k hospitals fastest to reach from the ambulance, e.g. to divert from a full hospital.
+        :return: A list of hospitals, fastest first
+        """
 
-    def find_fastest_hospital(self, location):
+        ambulance_index = ambulance.location_index(self.travel_times.origins)
 
-        shortest_time = timedelta.max
-        fastest_hosp = None
+        return [hospital for hospital, _ in self.find_fastest_hospitals_by_index(ambulance_index, k)]
 
-        loc_set_2 = self.travel_times.destinations
+    def find_fastest_hospital(self, location):
 
-        for hospital_location in self.hospital_set.locations:
+        _, location_index, location_distance = self.travel_times.origins.closest(location)
+        if location_distance > 0:
+            raise Exception("Location 1 does not exist in location set 1")
 
-            # Compute closest location in location set 2 to the hospital
-            closest_loc_to_hospital = loc_set_2.closest(hospital_location)[0]
+        return self.find_fastest_hospital_by_index(location_index)
 
-            # Compute the time from the location point mapped to the ambulance
-            # to the location point mapped to the hospital
-            time = self.travel_times.get_time(location, closest_loc_to_hospital)
+    def find_fastest_hospital_by_index(self, location_index):
 
-            if shortest_time > time:
-                shortest_time = time
-                fastest_hosp = hospital_location
+        fastest_hosp = self.hospital_set.locations[self.fastest_hospitals[location_index]]
+        shortest_time = timedelta(seconds=int(self.fastest_times[location_index]))
 
         return fastest_hosp, shortest_time
+
+    def find_fastest_hospitals_by_index(self, location_index, k: int):
+        """
+        Finds the k hospitals fastest to reach from a location in location set 1.
+        :param location_index:
+        :param k:
+        :return: A list of (hospital, travel time), fastest first; ties go to the first hospital
+        """
+
+        times = self.hospital_times[location_index]
+        fastest = np.argsort(times, kind='stable')[:k]
+
+        return [(self.hospital_set.locations[hospital], timedelta(seconds=int(times[hospital])))
+                for hospital in fastest]
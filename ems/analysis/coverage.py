@@ -1,215 +1,333 @@
+import math
 from datetime import timedelta, datetime
 
-from ems.analysis.metric import Metric
+import numpy as np
+
+from ems.analysis.metric import Metric, StateChange
 from ems.datasets.location import LocationSet
 from ems.datasets.times import TravelTimes
 
 
-# Computes a percent coverage given a radius
-class PercentDoubleCoverage(Metric):
-    """ """
+# Maintains the number of ambulances covering each demand within a radius
+class CoverageState:
 
     def __init__(self,
-                 demands: LocationSet,
                  travel_times: TravelTimes,
-                 r1: int = 600,
-                 r2: int = 840,
-                 tag=['primary_coverage', 'secondary_coverage']):
-        super().__init__(tag=tag)
-        self.demands = demands
+                 demand_indices: np.ndarray,
+                 radius: timedelta,
+                 inclusive: bool = False):
+        """
+        :param travel_times:
+        :param demand_indices: Index of the closest point in location set 2 to each demand
+        :param radius: A demand is covered by an ambulance within this travel time
+        :param inclusive: Whether a travel time equal to the radius counts as covered
+        """
         self.travel_times = travel_times
-        self.r1 = timedelta(seconds=r1)
-        self.r2 = timedelta(seconds=r2)
+        self.demand_indices = demand_indices
+        self.radius = radius
+        self.inclusive = inclusive
 
-        # Caching for better performance
-        self.primary_coverage_state = PercentCoverageState(ambulances=set(),
-                                                           locations_coverage=[set() for _ in demands.locations])
+        # Ambulances currently covering, mapped to the index of their location in location set 1
+        self.ambulances = {}
 
-        self.secondary_coverage_state = PercentCoverageState(ambulances=set(),
-                                                             locations_coverage=[set() for _ in demands.locations])
+        # Number of ambulances covering each demand
+        self.counts = np.zeros(len(demand_indices), dtype=int)
 
-    def calculate(self,
-                  timestamp: datetime,
-                  **kwargs):
-        """ TODO """
-        if "ambulances" not in kwargs:
-            return None
+        # Rows of the boolean coverage matrix, computed once per location in location set 1
+        self.coverage_rows = {}
 
-        ambulances = kwargs["ambulances"]
+    def coverage(self, origin_index):
+        """
+        Computes which demands are covered from a location in location set 1.
+        :param origin_index:
+        :return: A boolean array over the demands
+        """
+
+        if origin_index not in self.coverage_rows:
+            times = self.travel_times.get_times_from_index(origin_index, self.demand_indices)
+            radius = self.radius.total_seconds()
+            self.coverage_rows[origin_index] = times <= radius if self.inclusive else times < radius
+
+        return self.coverage_rows[origin_index]
 
-        available_ambulances = [amb for amb in ambulances if not amb.deployed]
+    def update(self, available_ambulances):
+        """
+        Adds and removes coverage so that exactly the given ambulances are covering.
+        :param available_ambulances:
+        """
 
-        ambulances_to_add = [a for a in available_ambulances if a not in self.primary_coverage_state.ambulances]
-        ambulances_to_remove = [a for a in self.primary_coverage_state.ambulances if a not in available_ambulances]
+        available_ambulances = set(available_ambulances)
+
+        ambulances_to_add = [a for a in available_ambulances if a not in self.ambulances]
+        ambulances_to_remove = [a for a in self.ambulances if a not in available_ambulances]
 
         for ambulance in ambulances_to_add:
-            self.add_ambulance_coverage(ambulance)
+            self.add(ambulance)
 
         for ambulance in ambulances_to_remove:
-            self.remove_ambulance_coverage(ambulance)
+            self.remove(ambulance)
 
-        primary = 0
-        for location_coverage in self.primary_coverage_state.locations_coverage:
-            if len(location_coverage) > 0:
-                primary += 1
+    def add(self, ambulance):
+        origin_index = ambulance.location_index(self.travel_times.origins)
+        self.counts += self.coverage(origin_index)
 
-        secondary = 0
+        # Register ambulance as covering some area
+        self.ambulances[ambulance] = origin_index
 
-        # Generate both the coverages # TODO update this comment if it's wrong
-        for i in range(len(self.secondary_coverage_state.locations_coverage)):
-            location_secondary_ambs = self.secondary_coverage_state.locations_coverage[i]
-            location_primary_ambs = self.primary_coverage_state.locations_coverage[i]
+    def remove(self, ambulance):
 
-            if len(location_primary_ambs) > 0:
-                if len(location_secondary_ambs) > 0:
+        # Unregister ambulance using the location it was registered with
+        origin_index = self.ambulances.pop(ambulance)
+        self.counts -= self.coverage(origin_index)
 
-                    if len(location_primary_ambs) == 1:
-                        if location_secondary_ambs != location_primary_ambs:
-                            secondary += 1
-                    else:
-                        secondary += 1
+    def covered(self):
+        """ :return: The number of demands covered by at least one ambulance """
+        return int(np.count_nonzero(self.counts))
 
-        result = round(primary / len(self.demands) * 100, 4), round(secondary / len(self.demands) * 100, 4)
-        return result
 
-    def add_ambulance_coverage(self, ambulance):
+# Maintains the travel time from the closest ambulance to each demand
+class NearestTimeState:
 
-        # Retrieve closest point from set 1 to the ambulance
-        closest_to_amb, _, _ = self.travel_times.origins.closest(ambulance.location)
+    def __init__(self,
+                 travel_times: TravelTimes,
+                 demand_indices: np.ndarray):
+        """
+        :param travel_times:
+        :param demand_indices: Index of the closest point in location set 2 to each demand
+        """
+        self.travel_times = travel_times
+        self.demand_indices = demand_indices
 
-        for index, demand_loc in enumerate(self.demands.locations):
+        # Ambulances currently counted, mapped to the index of their location in location set 1
+        self.ambulances = {}
 
-            # Retrieve closest point from set 2 to the demand
-            closest_to_demand, _, _ = self.travel_times.destinations.closest(demand_loc)
+        # Travel time in whole seconds from the closest ambulance to each demand; the largest integer if none
+        self.times = np.full(len(demand_indices), np.iinfo(np.int64).max, dtype=np.int64)
 
-            # Compute time and determine if less than r1
-            if self.travel_times.get_time(closest_to_amb, closest_to_demand) < self.r1:
-                self.primary_coverage_state.locations_coverage[index].add(ambulance)
+        # Travel times to the demands, computed once per location in location set 1
+        self.time_rows = {}
 
-            if self.travel_times.get_time(closest_to_amb, closest_to_demand) < self.r2:
-                self.secondary_coverage_state.locations_coverage[index].add(ambulance)
+    def row(self, origin_index):
+        if origin_index not in self.time_rows:
+            self.time_rows[origin_index] = self.travel_times.get_times_from_index(origin_index, self.demand_indices)
 
-        # Register ambulance as covering some area
-        self.primary_coverage_state.ambulances.add(ambulance)
-        self.secondary_coverage_state.ambulances.add(ambulance)
+        return self.time_rows[origin_index]
 
-    def remove_ambulance_coverage(self, ambulance):
+    def update(self, available_ambulances):
+        """
+        Adds and removes ambulances so that exactly the given ambulances are counted.
+        :param available_ambulances:
+        """
 
-        for location_coverage in self.primary_coverage_state.locations_coverage:
+        available_ambulances = set(available_ambulances)
 
-            # Remove ambulance from covering the location
-            if ambulance in location_coverage:
-                location_coverage.remove(ambulance)
+        ambulances_to_add = [a for a in available_ambulances if a not in self.ambulances]
+        ambulances_to_remove = [a for a in self.ambulances if a not in available_ambulances]
 
-        # Unregister ambulance as covering some area
-        self.primary_coverage_state.ambulances.remove(ambulance)
+        for ambulance in ambulances_to_add:
+            self.add(ambulance)
 
-        for location_coverage in self.secondary_coverage_state.locations_coverage:
+        for ambulance in ambulances_to_remove:
+            self.remove(ambulance)
 
-            # Remove ambulance from covering the location
-            if ambulance in location_coverage:
-                location_coverage.remove(ambulance)
+    def add(self, ambulance):
+        origin_index = ambulance.location_index(self.travel_times.origins)
+        np.minimum(self.times, self.row(origin_index), out=self.times)
 
-        # Unregister ambulance as covering some area
-        self.secondary_coverage_state.ambulances.remove(ambulance)
+        self.ambulances[ambulance] = origin_index
 
+    def remove(self, ambulance):
 
-class PercentCoverageState:
+        # Only the demands this ambulance was closest to need the closest of the other ambulances
+        origin_index = self.ambulances.pop(ambulance)
+        affected = np.flatnonzero(self.row(origin_index) == self.times)
 
-    def __init__(self,
-                 ambulances,
-                 locations_coverage):
-        self.ambulances = ambulances
-        self.locations_coverage = locations_coverage
+        if len(affected) == 0:
+            return
+
+        origin_indices = set(self.ambulances.values())
+        if origin_indices:
+            self.times[affected] = np.min([self.row(index)[affected] for index in origin_indices], axis=0)
+        else:
+            self.times[affected] = np.iinfo(np.int64).max
+
+
+def snap_demands(demands: LocationSet, travel_times: TravelTimes):
+    """
+    Computes the index of the closest point in location set 2 to each demand.
+    :return: Array of indices
+    """
+    indices, _ = travel_times.destinations.closest_many([demand_loc.latitude for demand_loc in demands.locations],
+                                                        [demand_loc.longitude for demand_loc in demands.locations])
+    return indices.astype(int)
 
 
 # Computes a percent coverage given a radius
-class PercentCoverage(Metric):
+class PercentDoubleCoverage(Metric):
+    """ """
+
+    dependencies = frozenset([StateChange.AMBULANCES])
 
     def __init__(self,
                  demands: LocationSet,
                  travel_times: TravelTimes,
                  r1: int = 600,
-                 tag='percent_coverage'):
+                 r2: int = 840,
+                 tag=['primary_coverage', 'secondary_coverage']):
         super().__init__(tag=tag)
         self.demands = demands
         self.travel_times = travel_times
         self.r1 = timedelta(seconds=r1)
+        self.r2 = timedelta(seconds=r2)
 
         # Caching for better performance
-        self.coverage_state = PercentCoverageState(ambulances=set(),
-                                                   locations_coverage=[set() for _ in demands.locations])
+        demand_indices = snap_demands(demands, travel_times)
+        self.primary_coverage_state = CoverageState(travel_times=travel_times,
+                                                    demand_indices=demand_indices,
+                                                    radius=self.r1)
+
+        self.secondary_coverage_state = CoverageState(travel_times=travel_times,
+                                                      demand_indices=demand_indices,
+                                                      radius=self.r2)
 
     def calculate(self,
                   timestamp: datetime,
                   **kwargs):
-
+        """ TODO """
         if "ambulances" not in kwargs:
             return None
 
         ambulances = kwargs["ambulances"]
 
-        available_ambulances = [amb for amb in ambulances if not amb.deployed]
+        available_ambulances = kwargs.get("available_ambulances")
+        if available_ambulances is None:
+            available_ambulances = [amb for amb in ambulances if not amb.deployed]
 
-        ambulances_to_add = [a for a in available_ambulances if a not in self.coverage_state.ambulances]
-        ambulances_to_remove = [a for a in self.coverage_state.ambulances if a not in available_ambulances]
+        self.primary_coverage_state.update(available_ambulances)
+        self.secondary_coverage_state.update(available_ambulances)
 
-        for ambulance in ambulances_to_add:
-            self._add_ambulance_coverage(ambulance)
+        primary = self.primary_coverage_state.covered()
+        secondary = int(self.count_secondary(self.primary_coverage_state.counts, self.secondary_coverage_state.counts))
 
-        for ambulance in ambulances_to_remove:
-            self._remove_ambulance_coverage(ambulance)
+        result = round(primary / len(self.demands) * 100, 4), round(secondary / len(self.demands) * 100, 4)
+        return result
 
-        sm = 0
-        for location_coverage in self.coverage_state.locations_coverage:
-            if len(location_coverage) > 0:
-                sm += 1
-        return sm / len(self.demands)
+    def calculate_without_each(self, ambulances):
+        """
+        Computes, for each ambulance, the coverage of the other ambulances. Equivalent to calling
+        calculate once per ambulance with that ambulance left out, but each result only costs the
+        marginal loss of that ambulance over the per-demand coverage counts.
+        :param ambulances: The available ambulances
+        :return: A list of (primary, secondary) coverages in the order of the ambulances
+        """
 
-    def _add_ambulance_coverage(self, ambulance):
+        self.primary_coverage_state.update(ambulances)
+        self.secondary_coverage_state.update(ambulances)
 
-        # Retrieve closest point from set 1 to the ambulance
-        closest_to_amb, _, _ = self.travel_times.origins.closest(ambulance.location)
+        primary_counts = self.primary_coverage_state.counts
+        secondary_counts = self.secondary_coverage_state.counts
+        covered = self.primary_coverage_state.covered()
 
-        for index, demand_loc in enumerate(self.demands.locations):
+        results = []
+        for ambulance in ambulances:
+            primary_coverage = self.primary_coverage_state.coverage(self.primary_coverage_state.ambulances[ambulance])
+            secondary_coverage = self.secondary_coverage_state.coverage(
+                self.secondary_coverage_state.ambulances[ambulance])
 
-            # Retrieve closest point from set 2 to the demand
-            closest_to_demand, _, _ = self.travel_times.destinations.closest(demand_loc)
+            # A demand covered only by this ambulance is lost when it is dispatched
+            primary = covered - int(np.count_nonzero(primary_coverage & (primary_counts == 1)))
+            secondary = int(self.count_secondary(primary_counts - primary_coverage,
+                                                 secondary_counts - secondary_coverage))
 
-            # Compute time and determine if less than r1
-            if self.travel_times.get_time(closest_to_amb, closest_to_demand) <= self.r1:
-                self.coverage_state.locations_coverage[index].add(ambulance)
+            results.append((round(primary / len(self.demands) * 100, 4),
+                            round(secondary / len(self.demands) * 100, 4)))
 
-        # Register ambulance as covering some area
-        self.coverage_state.ambulances.add(ambulance)
+        return results
+
+    def count_secondary(self, primary_counts, secondary_counts):
+        """
+        Counts the demands with secondary coverage: a demand covered by one ambulance within r1 and
+        by a different ambulance within r2. Accepts arrays of counts with demands on the last axis.
+        :return: The number of demands with secondary coverage
+        """
+
+        # The ambulances within the smaller radius are a subset of those within the larger radius, so the
+        # demand needs one ambulance within the smaller radius and two within the larger radius
+        if self.r1 <= self.r2:
+            secondary = (primary_counts > 0) & (secondary_counts > 1)
+        else:
+            secondary = (primary_counts > 1) & (secondary_counts > 0)
+
+        return np.count_nonzero(secondary, axis=-1)
+
+
+# Computes a percent coverage given a radius
+class PercentCoverage(Metric):
+
+    dependencies = frozenset([StateChange.AMBULANCES])
+
+    def __init__(self,
+                 demands: LocationSet,
+                 travel_times: TravelTimes,
+                 r1: int = 600,
+                 tag='percent_coverage'):
+        super().__init__(tag=tag)
+        self.demands = demands
+        self.travel_times = travel_times
+        self.r1 = timedelta(seconds=r1)
 
-    def _remove_ambulance_coverage(self, ambulance):
+        # Caching for better performance
+        self.coverage_state = CoverageState(travel_times=travel_times,
+                                            demand_indices=snap_demands(demands, travel_times),
+                                            radius=self.r1,
+                                            inclusive=True)
 
-        for location_coverage in self.coverage_state.locations_coverage:
+    def calculate(self,
+                  timestamp: datetime,
+                  **kwargs):
 
-            # Remove ambulance from covering the location
-            if ambulance in location_coverage:
-                location_coverage.remove(ambulance)
+        if "ambulances" not in kwargs:
+            return None
+
+        ambulances = kwargs["ambulances"]
+
+        available_ambulances = kwargs.get("available_ambulances")
+        if available_ambulances is None:
+            available_ambulances = [amb for amb in ambulances if not amb.deployed]
+
+        self.coverage_state.update(available_ambulances)
 
-        # Unregister ambulance as covering some area
-        self.coverage_state.ambulances.remove(ambulance)
+        return self.coverage_state.covered() / len(self.demands)
 
 
-# Computes a radius coverage
+# Computes a radius coverage: the travel time within which the closest available ambulance reaches a given
+# percent of the demands
 class RadiusCoverage(Metric):
 
+    dependencies = frozenset([StateChange.AMBULANCES])
+
     def __init__(self,
                  demands: LocationSet,
                  travel_times: TravelTimes,
                  percent: float = 85,
                  tag="radius_coverage"):
+        """
+        :param demands:
+        :param travel_times:
+        :param percent: Percent of the demands reached within the radius; 100 for the farthest demand
+        :param tag:
+        """
         super().__init__(tag)
         self.demands = demands
         self.travel_times = travel_times
         self.percent = percent
 
-        # self.coverage_state = RadiusCoverageState(ambulances=[],
-        #                                           tt_to_ambulance=[None for _ in demands.locations])
+        # Demands are snapped once; the closest ambulance times are updated as ambulances come and go
+        self.coverage_state = NearestTimeState(travel_times=travel_times,
+                                               demand_indices=snap_demands(demands, travel_times))
+
+        # Position of the radius among the closest ambulance times, in increasing order
+        self.rank = min(max(math.ceil(percent / 100 * len(demands)) - 1, 0), len(demands) - 1)
 
     def calculate(self,
                   timestamp: datetime,
@@ -220,29 +338,14 @@ class RadiusCoverage(Metric):
 
         ambulances = kwargs["ambulances"]
 
-        # available_ambulances = [amb for amb in ambulances if not amb.deployed]
-        #
-        # ambulances_to_add = [a for a in available_ambulances if a not in self.coverage_state.ambulances]
-        # ambulances_to_remove = [a for a in self.coverage_state.ambulances if a not in available_ambulances]
-
-        # Snap ambulance location to closest location in loc_set_1
-        ambulance_locations = [self.travel_times.origins.closest(ambulance.location)[0] for ambulance in ambulances if
-                               not ambulance.deployed]
+        available_ambulances = kwargs.get("available_ambulances")
+        if available_ambulances is None:
+            available_ambulances = [amb for amb in ambulances if not amb.deployed]
 
-        if len(ambulance_locations) == 0:
+        if len(available_ambulances) == 0:
             return -1
 
-        # Snap demand location to closest location in loc_set_2
-        demand_locations = [self.travel_times.destinations.closest(demand_location)[0] for demand_location in
-                            self.demands.locations]
-
-        min_tts = []
-
-        # Find the travel time from each demand to the closest ambulance (aka minimum travel time)
-        for demand_location in demand_locations:
-            tt_to_ambulance = [self.travel_times.get_time(ambulance_location, demand_location) for ambulance_location in
-                               ambulance_locations]
-            min_tts.append(min(tt_to_ambulance))
+        self.coverage_state.update(available_ambulances)
 
-        # Take the max of those travel times
-        return max(min_tts).seconds
+        # Smallest travel time within which the closest ambulance reaches the percent of the demands
+        return int(np.partition(self.coverage_state.times, self.rank)[self.rank])
@@ -1,12 +1,74 @@
 from datetime import datetime
 from datetime import timedelta
+from enum import Enum
+import os
+import shutil
+import tempfile
+import weakref
 from typing import List
 
+import numpy as np
 import pandas as pd
 
 
+# Format of the times in the metric files, whether written at once or flushed in parts
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def format_datetimes(values):
+    """ :return: The datetime64 values as strings in DATETIME_FORMAT; empty for missing values """
+    return pd.Series(values).dt.strftime(DATETIME_FORMAT).fillna("").tolist()
+
+
+def format_timedeltas(values):
+    """ :return: The timedelta64 values as strings like "-1 days 02:03:04.000005"; empty for missing values """
+
+    formatted = []
+    for value in np.asarray(values, dtype='timedelta64[us]'):
+        if np.isnat(value):
+            formatted.append("")
+            continue
+
+        microseconds = int(value.astype(np.int64))
+        sign = "-" if microseconds < 0 else ""
+        seconds, microseconds = divmod(abs(microseconds), 1000000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        formatted.append("{}{} days {:02d}:{:02d}:{:02d}.{:06d}".format(sign, days, hours, minutes, seconds,
+                                                                        microseconds))
+
+    return formatted
+
+
+def parse_timedeltas(values):
+    """ Parses the strings written by format_timedeltas """
+
+    parsed = []
+    for value in values:
+        if pd.isnull(value) or value == "":
+            parsed.append(pd.NaT)
+        elif value.startswith("-"):
+            parsed.append(-pd.Timedelta(value[1:]))
+        else:
+            parsed.append(pd.Timedelta(value))
+
+    return pd.Series(parsed, dtype='timedelta64[us]')
+
+
+# Changes of the simulation state that metrics may depend on
+class StateChange(Enum):
+    AMBULANCES = "Ambulance deployed or freed"
+    PENDING_CASES = "Case added to or removed from the pending queue"
+    ONGOING_CASES = "Case started or finished"
+    TIME = "Simulation time advanced"
+
+
 class Metric:
 
+    # The metric is only evaluated again when one of these changes happens; by default, on every change
+    dependencies = frozenset(StateChange)
+
     def __init__(self, tag: str):
         self.tag = tag
 
@@ -21,6 +83,8 @@ class Metric:
 
 class CountPending(Metric):
 
+    dependencies = frozenset([StateChange.PENDING_CASES])
+
     def __init__(self, tag="count_pending"):
         super().__init__(tag)
 
@@ -34,6 +98,8 @@ class CountPending(Metric):
 
 class TotalDelay(Metric):
 
+    dependencies = frozenset([StateChange.PENDING_CASES, StateChange.TIME])
+
     def __init__(self, tag="total_delay"):
         super().__init__(tag)
 
@@ -51,9 +117,129 @@ class TotalDelay(Metric):
         return total_delay
 
 
+# A column of metric values stored in typed numpy chunks
+class MetricColumn:
+
+    def __init__(self, chunk_size: int = 4096):
+        self.chunk_size = chunk_size
+        self.dtype = None
+        self.chunks = []
+        self.size = 0
+
+        # Number of missing values seen before the type of the column is known
+        self.leading_missing = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        """ The number of bytes held by the recorded values """
+        return self.size * (self.dtype.itemsize if self.dtype is not None else 0)
+
+    @staticmethod
+    def infer_dtype(value):
+        if isinstance(value, timedelta):
+            return np.dtype('timedelta64[us]')
+        if isinstance(value, datetime):
+            return np.dtype('datetime64[us]')
+        if isinstance(value, (bool, np.bool_)):
+            return np.dtype(object)
+        if isinstance(value, (int, np.integer)):
+            return np.dtype(np.int64)
+        if isinstance(value, (float, np.floating)):
+            return np.dtype(np.float64)
+        return np.dtype(object)
+
+    @staticmethod
+    def missing_value(dtype):
+        if dtype.kind in 'mM':
+            return np.array('NaT', dtype=dtype)[()]
+        if dtype.kind == 'f':
+            return np.nan
+        return None
+
+    def append(self, value):
+
+        if value is None:
+            if self.dtype is None:
+                self.leading_missing += 1
+                self.size += 1
+                return
+
+            # Integers have no missing value
+            if self.dtype.kind == 'i':
+                self.convert(np.dtype(np.float64))
+
+            value = MetricColumn.missing_value(self.dtype)
+
+        else:
+            dtype = MetricColumn.infer_dtype(value)
+
+            if self.dtype is None:
+                self.start(dtype)
+            elif dtype != self.dtype:
+                if self.dtype.kind == 'i' and dtype.kind == 'f':
+                    self.convert(dtype)
+                elif not (self.dtype.kind == 'f' and dtype.kind == 'i'):
+                    self.convert(np.dtype(object))
+
+        position = self.size % self.chunk_size
+        if position == 0:
+            self.chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+        self.chunks[-1][position] = value
+        self.size += 1
+
+    def start(self, dtype):
+        """ Fixes the type of the column and fills in the missing values seen so far. """
+
+        self.dtype = dtype if self.leading_missing == 0 or dtype.kind != 'i' else np.dtype(np.float64)
+        missing = MetricColumn.missing_value(self.dtype)
+
+        for index in range(self.leading_missing):
+            if index % self.chunk_size == 0:
+                self.chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+            self.chunks[-1][index % self.chunk_size] = missing
+
+    def convert(self, dtype):
+        self.dtype = dtype
+        self.chunks = [chunk.astype(dtype) for chunk in self.chunks]
+
+    def values(self):
+        """ :return: The values of the column as one array """
+
+        if self.dtype is None:
+            return np.full(self.size, np.nan)
+
+        if not self.chunks:
+            return np.empty(0, dtype=self.dtype)
+
+        values = np.concatenate(self.chunks)
+        return values[:self.size]
+
+    def clear(self):
+        self.chunks = []
+        self.size = 0
+        self.leading_missing = 0
+
+
 class MetricAggregator:
     def __init__(self,
-                 metrics: List[Metric] = None):
+                 metrics: List[Metric] = None,
+                 sample_every: int = 1,
+                 sample_interval: float = None,
+                 chunk_size: int = 4096,
+                 flush_bytes: int = None,
+                 flush_filename: str = None):
+        """
+        :param metrics:
+        :param sample_every: Record the metrics at every k-th call to calculate
+        :param sample_interval: Record the metrics at most once per this many seconds of simulation time
+        :param chunk_size: Number of values by which the column buffers grow
+        :param flush_bytes: Flush the recorded values to disk when the buffers hold more than this many bytes
+        :param flush_filename: CSV file receiving the flushed values; a file in a temporary directory, removed
+        with the aggregator, if None
+        """
 
         if metrics is None:
             metrics = []
@@ -73,7 +259,31 @@ class MetricAggregator:
 
         self.tags = tags  # The flattened list of tag strings.
         self.metrics = metrics
-        self.results = []
+
+        self.sample_every = sample_every
+        self.sample_interval = timedelta(seconds=sample_interval) if sample_interval is not None else None
+        self.calls = 0
+        self.last_sample_time = None
+
+        # Last value of each metric and the changes since the metrics were last evaluated
+        self.values = [None for _ in metrics]
+        self.changes = set(StateChange)
+
+        self.chunk_size = chunk_size
+        self.columns = {tag: MetricColumn(chunk_size) for tag in ["timestamp"] + self.tags}
+
+        self.flush_bytes = flush_bytes
+        self.flush_filename = flush_filename
+        self.flushed_rows = 0
+
+        # Temporary directory of the flush file, if it was not given
+        self.flush_directory = None
+        self.finalizer = None
+
+    @property
+    def results(self):
+        """ The recorded metrics as a list of dictionaries, one per sample. """
+        return self.to_dataframe().to_dict('records')
 
     def add_metric(self, metric: Metric):
 
@@ -81,16 +291,52 @@ class MetricAggregator:
             raise Exception("Metric with tag '{}' already exists".format(metric.tag))
 
         self.metrics.append(metric)
+        self.values.append(None)
+        self.changes.update(StateChange)
 
     def remove_metric(self, metric: Metric):
+        del self.values[self.metrics.index(metric)]
         self.metrics.remove(metric)
 
+    def sample(self, timestamp: datetime):
+        """ Decides whether the metrics at the given time are recorded. """
+
+        self.calls += 1
+
+        if (self.calls - 1) % self.sample_every != 0:
+            return False
+
+        if self.sample_interval is not None and self.last_sample_time is not None \
+                and timestamp - self.last_sample_time < self.sample_interval:
+            return False
+
+        self.last_sample_time = timestamp
+        return True
+
     def calculate(self,
                   timestamp: datetime,
+                  changes=None,
                   **kwargs):
+        """
+        :param timestamp:
+        :param changes: The state changes since the last call; metrics that depend on none of them carry
+        their last value forward. All metrics are evaluated if None.
+        :return: The values of the metrics by tag
+        """
+
+        self.changes.update(StateChange if changes is None else changes)
+
+        # Not sampled: nothing is computed
+        if not self.sample(timestamp):
+            return {}
+
         d = {"timestamp": timestamp}
-        for metric in self.metrics:
-            calculation = metric.calculate(timestamp, **kwargs)
+        for index, metric in enumerate(self.metrics):
+
+            if not metric.dependencies.isdisjoint(self.changes):
+                self.values[index] = metric.calculate(timestamp, **kwargs)
+
+            calculation = self.values[index]
             # If a calculation is returned, at least one metric exists.
             if calculation is not None:
                 if isinstance(metric.tag, list):
@@ -99,9 +345,80 @@ class MetricAggregator:
                 else:
                     d[metric.tag] = calculation
 
-        self.results.append(d)
+        self.changes.clear()
+
+        self.record(d)
         return d
 
+    def record(self, d):
+
+        for tag, column in self.columns.items():
+            column.append(d.get(tag))
+
+        if self.flush_bytes is not None and sum(column.nbytes for column in self.columns.values()) > self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        """ Appends the buffered values to the flush file and clears the buffers. """
+
+        if self.flush_filename is None:
+            self.flush_directory = tempfile.mkdtemp(prefix="metrics_")
+            self.flush_filename = os.path.join(self.flush_directory, "metrics.csv")
+            self.finalizer = weakref.finalize(self, shutil.rmtree, self.flush_directory, ignore_errors=True)
+
+        df = self.buffered_dataframe(formatted=True)
+        df.to_csv(self.flush_filename, mode='w' if self.flushed_rows == 0 else 'a',
+                  header=self.flushed_rows == 0, index=False)
+        self.flushed_rows += len(df)
+
+        for column in self.columns.values():
+            column.clear()
+
+    def buffered_dataframe(self, formatted=False):
+        """
+        :param formatted: Write times and durations as strings in one fixed format, so that the output does not
+        depend on which values happen to be written together
+        :return: The buffered values as a dataframe
+        """
+
+        df = pd.DataFrame({tag: column.values() for tag, column in self.columns.items()},
+                          columns=["timestamp"] + self.tags)
+
+        if formatted:
+            for tag, column in self.columns.items():
+                if column.dtype is not None and column.dtype.kind == 'M':
+                    df[tag] = format_datetimes(df[tag])
+                elif column.dtype is not None and column.dtype.kind == 'm':
+                    df[tag] = format_timedeltas(df[tag])
+
+        return df
+
     def write_to_file(self, output_filename):
-        df = pd.DataFrame(self.results, columns=["timestamp"] + self.tags)
-        df.to_csv(output_filename, index=False)
+
+        if self.flushed_rows == 0:
+            self.buffered_dataframe(formatted=True).to_csv(output_filename, index=False)
+            return
+
+        # Copy the flushed values and append the buffered ones
+        shutil.copyfile(self.flush_filename, output_filename)
+        self.buffered_dataframe(formatted=True).to_csv(output_filename, mode='a', header=False, index=False)
+
+    def to_dataframe(self):
+        df = self.buffered_dataframe()
+
+        if self.flushed_rows > 0:
+            flushed_df = pd.read_csv(self.flush_filename, keep_default_na=False, na_values=[""],
+                                     float_precision="round_trip")
+            for tag, column in self.columns.items():
+                if column.dtype is not None and column.dtype.kind == 'M':
+                    flushed_df[tag] = pd.to_datetime(flushed_df[tag], format=DATETIME_FORMAT).astype(column.dtype)
+                elif column.dtype is not None and column.dtype.kind == 'm':
+                    flushed_df[tag] = parse_timedeltas(flushed_df[tag]).astype(column.dtype)
+            df = pd.concat([flushed_df, df], ignore_index=True)
+
+        return df
+
+    def close(self):
+        """ Deletes the temporary flush file, if any. """
+        if self.finalizer is not None:
+            self.finalizer()
@@ -1,14 +1,27 @@
 import bisect
+import csv
+import heapq
+import math
+import os
+import shutil
+import tempfile
+import weakref
 from datetime import datetime
 from datetime import timedelta
+from itertools import chain
 from typing import List
 
 import pandas as pd
 
+from ems.analysis.metric import DATETIME_FORMAT, format_datetimes, format_timedeltas, parse_timedeltas
 from ems.models.ambulance import Ambulance
 from ems.models.case import Case
 from ems.models.event import Event, EventType
 
+CASE_RECORD_COLUMNS = ["id", "date", "latitude", "longitude", "priority", "ambulance", "start_time"] + \
+                      [event_type.name + "_duration" for event_type in EventType] + \
+                      ["hospital_latitude", "hospital_longitude"]
+
 
 class CaseRecord:
 
@@ -25,6 +38,32 @@ class CaseRecord:
     def __lt__(self, other):
         return self.case < other.case
 
+    def to_dict(self):
+        d = {"id": self.case.id,
+             "date": self.case.date_recorded,
+             "latitude": self.case.incident_location.latitude,
+             "longitude": self.case.incident_location.longitude,
+             "priority": self.case.priority,
+             "ambulance": self.ambulance.id,
+             "start_time": self.start_time}
+
+        total_durations_other = timedelta(minutes=0)
+        for event in self.event_history:
+
+            if event == EventType.OTHER:
+                total_durations_other += event.duration
+            else:
+
+                d[event.event_type.name + "_duration"] = event.duration
+
+                if event.event_type == EventType.TO_HOSPITAL:
+                    d["hospital_latitude"] = event.destination.latitude
+                    d["hospital_longitude"] = event.destination.longitude
+
+        d["OTHER_duration"] = total_durations_other
+
+        return d
+
 
 class CaseRecordSet:
 
@@ -37,41 +76,194 @@ class CaseRecordSet:
         self.case_records = case_records
         self.case_records.sort()
 
+    def __len__(self):
+        return len(self.case_records)
+
     def add_case_record(self, case_record: CaseRecord):
         bisect.insort(self.case_records, case_record)
 
-    def write_to_file(self, output_filename):
-        a = []
+    @staticmethod
+    def format_value(value):
+        """
+        Formats values one at a time in fixed formats, so that the output does not depend on which records are
+        written together
+        """
+
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return ""
+
+        if isinstance(value, datetime):
+            return format_datetimes([value])[0]
+
+        if isinstance(value, timedelta):
+            return format_timedeltas([value])[0]
+
+        return str(value)
+
+    @staticmethod
+    def format_row(case_record: CaseRecord):
+        d = case_record.to_dict()
+        return [CaseRecordSet.format_value(d.get(column)) for column in CASE_RECORD_COLUMNS]
+
+    def iterate_rows(self):
+        """ Iterates over the formatted rows, ordered by case """
         for case_record in self.case_records:
+            yield CaseRecordSet.format_row(case_record)
+
+    def write_to_file(self, output_filename):
+        with open(output_filename, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(CASE_RECORD_COLUMNS)
+            writer.writerows(self.iterate_rows())
+
+    def to_dataframe(self):
+        a = [case_record.to_dict() for case_record in self.case_records]
+
+        df = pd.DataFrame(a, columns=CASE_RECORD_COLUMNS)
+        return df
+
+
+# A case record set that keeps no case records: finished cases are serialized to rows and written to disk in
+# batches. The output is the same as the output of CaseRecordSet.
+class StreamingCaseRecordSet(CaseRecordSet):
+
+    def __init__(self,
+                 batch_size: int = 10000,
+                 sort: bool = True,
+                 directory: str = None):
+        """
+        :param batch_size: Number of rows buffered in memory before they are written to disk
+        :param sort: Whether the output is ordered by case as in CaseRecordSet. Each batch is sorted on its own
+        and the batches are merged when writing the output, so memory stays bounded.
+        :param directory: Directory for the intermediate batch files; the system temporary directory if None.
+        The batch files are deleted by close(), when leaving a with block, or when the set is garbage collected.
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.sort = sort
+        self.directory = tempfile.mkdtemp(prefix="case_records_", dir=directory)
+        self.finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+        self.rows = []
+        self.run_filenames = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_case_record(self, case_record: CaseRecord):
+
+        # Rows start with a sort key that orders them like the case records
+        row = [case_record.case.date_recorded.strftime('%Y-%m-%d %H:%M:%S.%f')]
+        row += CaseRecordSet.format_row(case_record)
+
+        self.rows.append(row)
+        self.count += 1
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered rows to disk. """
+
+        if not self.rows:
+            return
+
+        # Sorting is stable, so records of cases recorded at the same time keep their order
+        if self.sort:
+            self.rows.sort(key=lambda row: row[0])
+
+        # Unsorted output only needs one file
+        if self.sort or not self.run_filenames:
+            self.run_filenames.append(os.path.join(self.directory, "batch_{}.csv".format(len(self.run_filenames))))
+
+        with open(self.run_filenames[-1], 'a', newline='') as f:
+            csv.writer(f, lineterminator='\n').writerows(self.rows)
+
+        self.rows = []
+
+    def iterate_rows(self):
+        """ Iterates over the rows, merging the sorted batches if the output is sorted """
+
+        self.flush()
+
+        files = [open(filename, newline='') for filename in self.run_filenames]
+        try:
+            readers = [csv.reader(f) for f in files]
+            rows = heapq.merge(*readers, key=lambda row: row[0]) if self.sort else chain(*readers)
+            for row in rows:
+                yield row[1:]
+        finally:
+            for f in files:
+                f.close()
+
+    def write_to_file(self, output_filename):
+        """ Writes the rows as CSV, or as Parquet if the file name ends with .parquet (requires pyarrow). """
+
+        if output_filename.endswith(".parquet"):
+            self.write_to_parquet(output_filename)
+            return
+
+        super().write_to_file(output_filename)
+
+    def write_to_parquet(self, output_filename):
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Writing case records to Parquet requires pyarrow")
+
+        writer = None
+        batch = []
+        for row in chain(self.iterate_rows(), [None]):
 
-            d = {"id": case_record.case.id,
-                 "date": case_record.case.date_recorded,
-                 "latitude": case_record.case.incident_location.latitude,
-                 "longitude": case_record.case.incident_location.longitude,
-                 "priority": case_record.case.priority,
-                 "ambulance": case_record.ambulance.id,
-                 "start_time": case_record.start_time}
+            if row is not None:
+                batch.append(row)
 
-            total_durations_other = timedelta(minutes=0)
-            for event in case_record.event_history:
+            if batch and (row is None or len(batch) >= self.batch_size):
+                table = pa.Table.from_pandas(StreamingCaseRecordSet.typed_dataframe(batch), preserve_index=False)
 
-                if event == EventType.OTHER:
-                    total_durations_other += event.duration
-                else:
+                if writer is None:
+                    writer = pq.ParquetWriter(output_filename, table.schema)
 
-                    d[event.event_type.name + "_duration"] = event.duration
+                writer.write_table(table.cast(writer.schema))
+                batch = []
 
-                    if event.event_type == EventType.TO_HOSPITAL:
-                        d["hospital_latitude"] = event.destination.latitude
-                        d["hospital_longitude"] = event.destination.longitude
+        if writer is not None:
+            writer.close()
+        else:
+            self.to_dataframe().to_parquet(output_filename, index=False)
 
-            d["OTHER_duration"] = total_durations_other
+    @staticmethod
+    def typed_dataframe(rows):
+        """ Converts formatted rows back to the columns of CaseRecordSet.to_dataframe """
 
-            a.append(d)
+        df = pd.DataFrame(rows, columns=CASE_RECORD_COLUMNS).replace("", None)
+        for column in CASE_RECORD_COLUMNS:
+            if column in ("date", "start_time"):
+                df[column] = pd.to_datetime(df[column], format=DATETIME_FORMAT).astype('datetime64[us]')
+            elif column.endswith("_duration"):
+                df[column] = parse_timedeltas(df[column])
+            elif column in ("latitude", "longitude", "hospital_latitude", "hospital_longitude"):
+                df[column] = pd.to_numeric(df[column]).astype(float)
+            elif column in ("id", "priority"):
+                # Integers, unless the cases have other kinds of identifiers or priorities
+                try:
+                    df[column] = pd.to_numeric(df[column])
+                except (ValueError, TypeError):
+                    pass
+        return df
 
-        event_labels = [event_type.name + "_duration" for event_type in EventType]
+    def to_dataframe(self):
+        return StreamingCaseRecordSet.typed_dataframe(list(self.iterate_rows()))
 
-        df = pd.DataFrame(a, columns=["id", "date", "latitude", "longitude",
-                                      "priority", "ambulance", "start_time"] + event_labels +
-                                     ["hospital_latitude", "hospital_longitude"])
-        df.to_csv(output_filename, index=False)
+    def close(self):
+        """ Deletes the intermediate batch files. """
+        self.finalizer()
+        self.run_filenames = []
@@ -0,0 +1,234 @@
+import datetime
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+
+# Bump to invalidate every cached artifact when the way artifacts are stored changes
+ARTIFACT_FORMAT_VERSION = 1
+
+
+class ArtifactPickler(pickle.Pickler):
+    """ Pickles an object, replacing the objects it was built from by their artifact keys """
+
+    def __init__(self, file, external_keys):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.external_keys = external_keys
+
+    def persistent_id(self, obj):
+        return self.external_keys.get(id(obj))
+
+
+class ArtifactUnpickler(pickle.Unpickler):
+    """ Unpickles an object, linking it back to the live objects it was built from """
+
+    def __init__(self, file, external_objects):
+        super().__init__(file)
+        self.external_objects = external_objects
+
+    def persistent_load(self, key):
+        return self.external_objects[key]
+
+
+class ArtifactCache:
+    """
+    On-disk cache of objects built by the Driver. An object is stored under a key hashing its class path, the
+    sources of the packages of its class hierarchy, its parameters, the content of its input files and the keys
+    of the objects it was built from, so an artifact is rebuilt whenever any of them changes. References to those
+    objects are not stored with the artifact: they are linked back to the live objects when the artifact is
+    restored. Least recently used artifacts are evicted beyond the size cap.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = None):
+        """
+        :param directory: Where the artifacts are stored
+        :param max_bytes: Size cap of the stored artifacts; no cap if None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        # Hashes of input files and module sources, by path, size and modification time
+        self.file_hashes = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def file_hash(self, filename):
+        stat = os.stat(filename)
+        signature = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+        if signature not in self.file_hashes:
+            sha = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            self.file_hashes[signature] = sha.hexdigest()
+
+        return self.file_hashes[signature]
+
+    def package_hash(self, package: str):
+        """
+        :param package: Name of a top level package or module
+        :return: A hash of all the Python sources of the package; None for built-in modules
+        """
+
+        module = sys.modules.get(package) or importlib.import_module(package)
+        try:
+            filename = inspect.getsourcefile(module)
+        except TypeError:
+            return None
+        if filename is None:
+            return None
+
+        # A module on its own
+        if os.path.basename(filename) != "__init__.py":
+            return self.file_hash(filename)
+
+        root = os.path.dirname(filename)
+        sha = hashlib.sha256()
+        for directory, directories, filenames in os.walk(root):
+            directories.sort()
+            for name in sorted(filenames):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    sha.update(os.path.relpath(path, root).encode())
+                    sha.update(self.file_hash(path).encode())
+
+        return sha.hexdigest()
+
+    def describe(self, value, object_keys):
+        """
+        Converts a parameter to a JSON description of its content.
+        :param value:
+        :param object_keys: Artifact keys of the objects built by the Driver, by object id
+        """
+
+        if id(value) in object_keys:
+            return {"object": object_keys[id(value)]}
+        if isinstance(value, dict):
+            return {str(key): self.describe(item, object_keys) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.describe(item, object_keys) for item in value]
+        if isinstance(value, np.ndarray):
+            return {"array": hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest(),
+                    "dtype": value.dtype.str,
+                    "shape": list(value.shape)}
+        if isinstance(value, str) and os.path.isfile(value):
+            return {"file": self.file_hash(value)}
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.timedelta)):
+            return repr(value)
+
+        # Objects not built by the Driver, e.g. passed in directly, are described by their pickle
+        return {"pickle": hashlib.sha256(pickle.dumps(value)).hexdigest()}
+
+    def key(self, cls, params, object_keys):
+        """
+        Computes the artifact key of an object.
+        :param cls: The class of the object
+        :param params: The parameters the object is built with
+        :param object_keys: Artifact keys of the objects built by the Driver, by object id
+        :return: The key
+        """
+
+        # The artifact depends on the code of the class, of the classes it inherits from and of everything they
+        # use, such as the spatial index of a location set: hash every source of their packages
+        packages = sorted(set(klass.__module__.split(".")[0] for klass in cls.__mro__))
+
+        description = {"version": ARTIFACT_FORMAT_VERSION,
+                       "class": cls.__module__ + "." + cls.__qualname__,
+                       "sources": [self.package_hash(package) for package in packages],
+                       "params": self.describe(params, object_keys)}
+
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, cls, key):
+        return os.path.join(self.directory, "{}-{}.pkl".format(cls.__name__, key))
+
+    def load(self, cls, key, external_objects):
+        """
+        Restores an artifact.
+        :param external_objects: The objects the artifact was built from, by artifact key
+        :return: The object, or None if it is not cached
+        """
+
+        path = self.path(cls, key)
+
+        try:
+            with open(path, 'rb') as f:
+                obj = ArtifactUnpickler(f, external_objects).load()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # Unreadable artifact, or one that refers to classes or objects that no longer exist: rebuild it
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError):
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        self.hits += 1
+        return obj
+
+    def store(self, cls, key, obj, external_objects):
+        """
+        Stores an artifact, then evicts the least recently used artifacts beyond the size cap.
+        :param external_objects: The objects the artifact was built from, by artifact key
+        """
+
+        buffer = io.BytesIO()
+        ArtifactPickler(buffer, {id(external): external_key
+                                 for external_key, external in external_objects.items()}).dump(obj)
+
+        # Write to a temporary file first so that concurrent runs never read a partial artifact
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(temporary_path, self.path(cls, key))
+
+        self.evict()
+
+    def artifacts(self):
+        """ :return: The paths of the stored artifacts, least recently used first """
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pkl")]
+        return sorted(paths, key=os.path.getmtime)
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.artifacts())
+
+    def evict(self):
+        if self.max_bytes is None:
+            return
+
+        paths = self.artifacts()
+        total = sum(os.path.getsize(path) for path in paths)
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def invalidate(self, class_name: str = None):
+        """
+        Removes the stored artifacts.
+        :param class_name: Only remove the artifacts of this class; all artifacts if None
+        """
+        for path in self.artifacts():
+            if class_name is None or os.path.basename(path).startswith(class_name + "-"):
+                os.remove(path)
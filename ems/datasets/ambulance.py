@@ -51,14 +51,15 @@ class AmbulanceSet:
         b_longitude_key = self.headers[2]
         capability_key = self.headers[3]
 
-        # Generate list of models from dataframe
+        # Generate list of models from the columns of the dataframe
         a = []
-        for index, row in ambulances_df.iterrows():
-            base = Point(row[b_latitude_key],
-                         row[b_longitude_key])
-            ambulance = Ambulance(id=row[id_key],
-                                  base=base,
-                                  capability=Capability[row[capability_key]])
+        for ambulance_id, b_latitude, b_longitude, capability in zip(ambulances_df[id_key].tolist(),
+                                                                     ambulances_df[b_latitude_key].tolist(),
+                                                                     ambulances_df[b_longitude_key].tolist(),
+                                                                     ambulances_df[capability_key].tolist()):
+            ambulance = Ambulance(id=ambulance_id,
+                                  base=Point(b_latitude, b_longitude),
+                                  capability=Capability[capability])
             a.append(ambulance)
 
         return a
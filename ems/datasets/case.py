@@ -1,6 +1,8 @@
 from datetime import datetime
 from typing import List
 
+import numpy as np
+import pandas as pd
 from geopy import Point
 
 from ems.generators.duration import DurationGenerator
@@ -42,16 +44,40 @@ class CSVCaseSet(CaseSet):
         self.headers = headers
         self.filename = filename
         self.event_generator = event_generator
-        self.cases = self.read_cases()
-        super().__init__(self.cases[0].date_recorded)
+        self.ids, self.dates, self.latitudes, self.longitudes, self.priorities = self.read_cases()
+        self.built_cases = None
+        super().__init__(self.dates[0].item())
+
+    @property
+    def cases(self):
+        """
+        All the cases as a list, built on first access and kept, so that the cases keep their identity and
+        their state. Until then, cases are only built while iterating.
+        """
+        if self.built_cases is None:
+            self.built_cases = [self.create_case(index) for index in range(len(self))]
+        return self.built_cases
 
     def iterator(self):
-        return iter(self.cases)
+        if self.built_cases is not None:
+            return iter(self.built_cases)
+        return (self.create_case(index) for index in range(len(self)))
+
+    def create_case(self, index):
+        return RandomCase(id=self.ids[index],
+                          date_recorded=self.dates[index].item(),
+                          incident_location=Point(self.latitudes[index], self.longitudes[index]),
+                          event_generator=self.event_generator,
+                          priority=self.priorities[index] if self.priorities is not None else None)
 
     def __len__(self):
-        return len(self.cases)
+        return len(self.ids)
 
     def read_cases(self):
+        """
+        Reads the columns of the cases, sorted by date.
+        :return: Lists of ids and priorities, and arrays of dates, latitudes and longitudes
+        """
 
         # Read cases from CSV into a pandas dataframe
         cases_df = parse_headered_csv(self.filename, self.headers)
@@ -63,19 +89,18 @@ class CSVCaseSet(CaseSet):
         longitude_key = self.headers[3]
         priority_key = self.headers[4] if len(self.headers) > 3 else None
 
-        # Generate list of models from dataframe
-        cases = []
-        for index, row in cases_df.iterrows():
-            case = RandomCase(id=row[id_key],
-                              date_recorded=datetime.strptime(row[timestamp_key], '%Y-%m-%d %H:%M:%S.%f'),
-                              incident_location=Point(row[latitude_key], row[longitude_key]),
-                              event_generator=self.event_generator,
-                              priority=row[priority_key] if priority_key is not None else None)
-            cases.append(case)
+        # Parse all the dates at once
+        dates = pd.to_datetime(cases_df[timestamp_key], format='%Y-%m-%d %H:%M:%S.%f').to_numpy(dtype='datetime64[us]')
+
+        # Sort by date, keeping the file order for cases recorded at the same time
+        order = np.argsort(dates, kind='stable')
 
-        cases.sort(key=lambda x: x.date_recorded)
+        ids = cases_df[id_key].to_numpy()[order].tolist()
+        latitudes = cases_df[latitude_key].to_numpy()[order]
+        longitudes = cases_df[longitude_key].to_numpy()[order]
+        priorities = cases_df[priority_key].to_numpy()[order].tolist() if priority_key is not None else None
 
-        return cases
+        return ids, dates[order], latitudes, longitudes, priorities
 
 
 # Implementation of a case set which is instantiated from a list of already known cases
@@ -100,9 +125,14 @@ class RandomCaseSet(CaseSet):
                  case_time_generator: DurationGenerator,
                  case_location_generator: LocationGenerator,
                  event_generator: EventGenerator,
-                 case_priority_generator: PriorityGenerator = RandomPriorityGenerator(),
+                 case_priority_generator: PriorityGenerator = None,
                  quantity: int = None):
         super().__init__(time)
+
+        # Each case set draws priorities from its own generator
+        if case_priority_generator is None:
+            case_priority_generator = RandomPriorityGenerator()
+
         self.time = time
         self.case_time_generator = case_time_generator
         self.location_generator = case_location_generator
@@ -1,7 +1,7 @@
 from typing import List
 
 from ems.datasets.location import LocationSet
-from ems.utils import parse_headered_csv
+from ems.utils import parse_coordinates_csv
 
 
 class DemandSet(LocationSet):
@@ -15,15 +15,7 @@ class DemandSet(LocationSet):
         super().__init__(latitudes, longitudes)
 
     def read_demands(self, filename):
-        # Read demands from a headered CSV into a pandas dataframe
-        demand_headers = ["latitude", "longitude"]
-        demands_df = parse_headered_csv(filename, demand_headers)
-
-        # Generate list of models from dataframe
-        latitudes = []
-        longitudes = []
-        for index, row in demands_df.iterrows():
-            latitudes.append(row["latitude"])
-            longitudes.append(row["longitude"])
+        # Read demands coordinates from a headered CSV into arrays
+        latitudes, longitudes = parse_coordinates_csv(filename)
 
         return latitudes, longitudes
@@ -1,7 +1,7 @@
 from typing import List
 
 from ems.datasets.location import KDTreeLocationSet
-from ems.utils import parse_headered_csv
+from ems.utils import parse_coordinates_csv
 
 
 class HospitalSet(KDTreeLocationSet):
@@ -15,15 +15,7 @@ class HospitalSet(KDTreeLocationSet):
         super().__init__(latitudes, longitudes)
 
     def read_hospitals(self, filename):
-        # Read hospitals from a headered CSV into a pandas dataframe
-        hospital_headers = ["latitude", "longitude"]
-        hospitals_df = parse_headered_csv(filename, hospital_headers)
-
-        # Generate list of models from dataframe
-        latitudes = []
-        longitudes = []
-        for index, row in hospitals_df.iterrows():
-            latitudes.append(row["latitude"])
-            longitudes.append(row["longitude"])
+        # Read hospitals coordinates from a headered CSV into arrays
+        latitudes, longitudes = parse_coordinates_csv(filename)
 
         return latitudes, longitudes
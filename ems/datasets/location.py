@@ -1,21 +1,48 @@
+import functools
 from typing import List
 
 import pandas as pd
 from geopy import Point
-from scipy.spatial import KDTree
 
+from ems.datasets.spatial import SpatialIndex
 from ems.generators.location import LocationGenerator
 
 
-# TODO -- Remove KD Tree functionality from base location set
 class LocationSet:
 
+    # Building the spatial index of a large set is slow: the Driver keeps built sets in its artifact cache
+    cacheable = True
+
     def __init__(self,
                  latitudes: List[float],
-                 longitudes: List[float]):
+                 longitudes: List[float],
+                 cache_size: int = 4096):
+        """
+        :param latitudes:
+        :param longitudes:
+        :param cache_size: Number of recently snapped coordinates whose closest point is kept
+        """
         self.locations = [Point(latitude=latitude, longitude=longitude)
                           for latitude, longitude in zip(latitudes, longitudes)]
-        self.kd_tree = self._initialize_kd_tree()
+
+        # Built once; answers every nearest neighbour and radius query on the set
+        self.spatial_index = SpatialIndex([location.latitude for location in self.locations],
+                                          [location.longitude for location in self.locations])
+
+        # Ambulances keep snapping the same bases and hospitals: cache the closest point by exact coordinates
+        self.cache_size = cache_size
+        self.cached_closest = functools.lru_cache(maxsize=cache_size)(self.closest_to_coordinates)
+
+    def __getstate__(self):
+        # The snapping cache is not stored with the set; a subclass may pickle itself before it is built
+        state = self.__dict__.copy()
+        state.pop("cached_closest", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "cache_size" in state:
+            self.cached_closest = functools.lru_cache(maxsize=self.cache_size)(self.closest_to_coordinates)
 
     def __len__(self):
         return len(self.locations)
@@ -31,79 +58,70 @@ class LocationSet:
         Finds the closest point in the corresponding generic list.
         For example, find the closest base given a GPS location.
         :param point:
-        :return: The closest point and its index
+        :return: The closest point, its index and the distance to it in kilometers
         """
 
-        # Query kd tree for nearest neighbor
-        closest_point_data = self.kd_tree.query((point.longitude, point.latitude))
+        return self.cached_closest(point.latitude, point.longitude)
 
-        # Retrieve closest point, its index, and the distance to it
-        closest_point_ind = closest_point_data[1]
-        closest_point = self.locations[closest_point_ind]
-        closest_point_distance = closest_point_data[0]
+    def closest_to_coordinates(self, latitude: float, longitude: float):
+        closest_point_ind, closest_point_distance = self.spatial_index.nearest(latitude, longitude)
+        return self.locations[closest_point_ind], closest_point_ind, closest_point_distance
 
-        return closest_point, closest_point_ind, closest_point_distance
-
-    def _initialize_kd_tree(self):
+    def prewarm(self, points: List[Point]):
         """
-        Initialize the kd_tree.
-        Helper Method.
-        :return:
+        Snaps points expected to recur, such as bases and hospitals, ahead of the simulation.
+        :param points:
         """
+        for point in points:
+            self.closest(point)
 
-        # Form a kd-tree with the given list of locations
-        points = [(loc.longitude, loc.latitude) for loc in self.locations]
-        kd_tree = KDTree(points)
-        return kd_tree
+    def cache_info(self):
+        """ :return: The hits, misses, maximum size and current size of the snapping cache """
+        return self.cached_closest.cache_info()
 
-    def write_to_file(self, output_filename: str):
-        a = [{"latitude": location.latitude,
-              "longitude": location.longitude} for location in self.locations]
-        df = pd.DataFrame(a, columns=["latitude", "longitude"])
-        df.to_csv(output_filename, index=False)
+    def clear_cache(self):
+        self.cached_closest.cache_clear()
 
-
-class KDTreeLocationSet(LocationSet):
-
-    def __init__(self,
-                 latitudes: List[float],
-                 longitudes: List[float]):
-        super().__init__(latitudes, longitudes)
-        self.kd_tree = self._initialize_kd_tree()
-
-    def _initialize_kd_tree(self):
+    def closest_many(self, latitudes, longitudes):
         """
-        Initialize the kd_tree.
-        Helper Method.
-        :return:
+        Finds the closest point to each of many locations at once.
+        :param latitudes:
+        :param longitudes:
+        :return: Arrays of the indices of the closest points and the great circle distances to them in kilometers
         """
+        return self.spatial_index.nearest_many(latitudes, longitudes)
 
-        # Form a kd-tree with the given list of locations
-        points = [(loc.longitude, loc.latitude) for loc in self.locations]
-        kd_tree = KDTree(points)
-        return kd_tree
+    def k_nearest(self, latitudes, longitudes, k: int):
+        """
+        Finds the k closest points to each of many locations.
+        :return: Arrays of the indices and the distances in kilometers, of shape (locations, k), closest first
+        """
+        return self.spatial_index.k_nearest(latitudes, longitudes, k)
 
-    def closest(self, point: Point):
+    def within_radius(self, latitudes, longitudes, radius_km: float):
         """
-        Finds the closest point in the corresponding generic list.
-        For example, find the closest base given a GPS location.
-        :param point:
-        :return: The closest point and its index
+        Finds the points within a distance of each of many locations.
+        :return: A list with an array of the indices of the points within the radius of each location
         """
+        return self.spatial_index.within(latitudes, longitudes, radius_km)
 
-        # Query kd tree for nearest neighbor
-        closest_point_data = self.kd_tree.query((point.longitude, point.latitude))
+    def write_to_file(self, output_filename: str):
+        a = [{"latitude": location.latitude,
+              "longitude": location.longitude} for location in self.locations]
+        df = pd.DataFrame(a, columns=["latitude", "longitude"])
+        df.to_csv(output_filename, index=False)
 
-        # Retrieve closest point, its index, and the distance to it
-        closest_point_ind = closest_point_data[1]
-        closest_point = self.locations[closest_point_ind]
-        closest_point_distance = closest_point_data[0]
 
-        return closest_point, closest_point_ind, closest_point_distance
+# Kept for configurations that name it; every location set is indexed by a KD tree
+class KDTreeLocationSet(LocationSet):
+    pass
 
 
 class RandomLocationSet(KDTreeLocationSet):
 
+    # Random locations differ from one run to the next
+    cacheable = False
+
     def __init__(self,
                  count: int,
                  generator: LocationGenerator):
@@ -0,0 +1,104 @@
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ems.distance import EARTH_RADIUS_KM, haversine_km, haversine_km_scalar
+
+
+def unit_vectors(latitudes, longitudes):
+    """
+    Converts coordinates to points on the unit sphere, where the straight line distance between two points
+    grows with their great circle distance.
+    :param latitudes: Latitudes in degrees
+    :param longitudes: Longitudes in degrees
+    :return: Array of shape (points, 3)
+    """
+
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+
+    cos_latitudes = np.cos(latitudes)
+    return np.stack([cos_latitudes * np.cos(longitudes),
+                     cos_latitudes * np.sin(longitudes),
+                     np.sin(latitudes)], axis=-1)
+
+
+def km_to_chord(distance_km):
+    """ :return: The straight line distance on the unit sphere between two points a great circle distance apart """
+    return 2 * np.sin(np.minimum(np.asarray(distance_km, dtype=float) / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+# Nearest neighbour, k-nearest and radius queries over a fixed set of coordinates. The KD tree is built once over
+# the points on the unit sphere, so that neighbours are the closest by great circle distance. Distances are
+# returned in kilometers, computed with the haversine formula from the coordinates themselves, so that a point of
+# the set is at a distance of exactly 0 from itself.
+class SpatialIndex:
+
+    def __init__(self, latitudes, longitudes):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.tree = cKDTree(unit_vectors(self.latitudes, self.longitudes))
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def nearest(self, latitude: float, longitude: float):
+        """
+        Finds the point closest to one location.
+        :return: The index of the closest point and the distance to it in kilometers
+        """
+
+        latitude_radians = math.radians(latitude)
+        longitude_radians = math.radians(longitude)
+        cos_latitude = math.cos(latitude_radians)
+
+        _, index = self.tree.query((cos_latitude * math.cos(longitude_radians),
+                                    cos_latitude * math.sin(longitude_radians),
+                                    math.sin(latitude_radians)))
+        index = int(index)
+
+        distance = haversine_km_scalar(latitude, longitude, self.latitudes[index], self.longitudes[index])
+        return index, distance
+
+    def nearest_many(self, latitudes, longitudes):
+        """
+        Finds the point closest to each of many locations.
+        :return: Arrays of the indices of the closest points and the distances to them in kilometers
+        """
+
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        _, indices = self.tree.query(unit_vectors(latitudes, longitudes))
+
+        distances = haversine_km(latitudes, longitudes, self.latitudes[indices], self.longitudes[indices])
+        return indices, distances
+
+    def k_nearest(self, latitudes, longitudes, k: int):
+        """
+        Finds the k points closest to each of many locations, or all points if there are fewer.
+        :return: Arrays of the indices and the distances in kilometers, of shape (locations, k), closest first
+        """
+
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        # A sequence of neighbour ranks always returns one column per rank
+        _, indices = self.tree.query(unit_vectors(latitudes, longitudes), k=list(range(1, min(k, len(self)) + 1)))
+
+        distances = haversine_km(latitudes[:, None], longitudes[:, None],
+                                 self.latitudes[indices], self.longitudes[indices])
+        return indices, distances
+
+    def within(self, latitudes, longitudes, radius_km: float):
+        """
+        Finds the points within a great circle distance of each of many locations.
+        :return: A list with an array of the indices of the points within the radius of each location, in
+        increasing index order
+        """
+
+        points = unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        neighbours = self.tree.query_ball_point(points, float(km_to_chord(radius_km)), return_sorted=True)
+
+        return [np.asarray(indices, dtype=int) for indices in neighbours]
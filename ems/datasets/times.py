@@ -1,16 +1,102 @@
+import hashlib
+import json
 import pandas as pd
 from datetime import timedelta
+from typing import List
 
 import numpy as np
 from geopy import Point
 
 from ems.datasets.location import LocationSet
 
+# Layout of the binary travel times format: the magic bytes, then a JSON header padded with spaces to
+# BINARY_HEADER_SIZE bytes, then the matrix of travel times as little-endian int32 seconds in row-major order
+BINARY_MAGIC = b"EMSTT\x00\x01\x00"
+BINARY_HEADER_SIZE = 4096
+BINARY_DTYPE = np.dtype('<i4')
+
+
+def describe_location_set(location_set: LocationSet):
+    """
+    Describes a location set in the header of a binary travel times file.
+    :return: The number of locations and a checksum of their coordinates
+    """
+    coordinates = np.array([(location.latitude, location.longitude) for location in location_set.locations],
+                           dtype='<f8')
+    return {"count": len(location_set), "sha256": hashlib.sha256(coordinates.tobytes()).hexdigest()}
+
+
+def is_binary_times_file(filename: str):
+    with open(filename, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def write_binary_header(f, header: dict):
+    encoded = json.dumps(header).encode()
+    if len(BINARY_MAGIC) + len(encoded) > BINARY_HEADER_SIZE:
+        raise Exception("Travel times header does not fit in {} bytes".format(BINARY_HEADER_SIZE))
+
+    f.seek(0)
+    f.write(BINARY_MAGIC + encoded.ljust(BINARY_HEADER_SIZE - len(BINARY_MAGIC)))
+
+
+def read_binary_header(filename: str):
+    with open(filename, 'rb') as f:
+        raw = f.read(BINARY_HEADER_SIZE)
+
+    if raw[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise Exception("{} is not a binary travel times file".format(filename))
+
+    return json.loads(raw[len(BINARY_MAGIC):].decode())
+
+
+def convert_times_csv(csv_filename: str,
+                      binary_filename: str,
+                      origins: LocationSet = None,
+                      destinations: LocationSet = None,
+                      chunk_size: int = 1000):
+    """
+    Converts a headerless CSV matrix of travel times into the binary format, reading the CSV in chunks of
+    rows so that the whole matrix is never held in memory. Times are truncated to whole seconds.
+
+    :param csv_filename:
+    :param binary_filename:
+    :param origins: If given, recorded in the header and checked when the file is opened
+    :param destinations: If given, recorded in the header and checked when the file is opened
+    :param chunk_size: Number of rows read at a time
+    :return: The shape of the matrix
+    """
+
+    rows = 0
+    columns = None
+
+    with open(binary_filename, 'wb') as f:
+        f.write(b" " * BINARY_HEADER_SIZE)
+
+        for chunk in pd.read_csv(csv_filename, header=None, chunksize=chunk_size):
+            values = chunk.values
+            columns = values.shape[1]
+            f.write(values.astype(BINARY_DTYPE).tobytes())
+            rows += values.shape[0]
+
+        header = {"version": 1,
+                  "dtype": BINARY_DTYPE.str,
+                  "shape": [rows, columns],
+                  "origins": describe_location_set(origins) if origins is not None else None,
+                  "destinations": describe_location_set(destinations) if destinations is not None else None}
+        write_binary_header(f, header)
+
+    return rows, columns
+
 
 class TravelTimes:
     """
     Maintains a matrix of travel travel_times between one set of locations to another set of locations
     """
+
+    # Reading a CSV matrix is slow: the Driver keeps built travel times in its artifact cache
+    cacheable = True
+
     def __init__(self,
                  origins: LocationSet,
                  destinations: LocationSet,
@@ -23,13 +109,42 @@ class TravelTimes:
         """
         self.origins = origins
         self.destinations = destinations
+        self.filename = filename
+        self.memory_mapped = False
 
         if filename is not None:
-            times = self.read_times_df(filename)
+            if is_binary_times_file(filename):
+                times = self.read_times_binary(filename)
+                self.memory_mapped = True
+            else:
+                times = self.read_times_df(filename)
+
+        if times is not None:
+            times = np.asarray(times)
 
         self.times = times
         # from IPython import embed; embed()
 
+    def __getstate__(self):
+        # A memory mapped matrix is opened again from its file rather than copied
+        state = self.__dict__.copy()
+        if self.memory_mapped:
+            state["times"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.memory_mapped:
+            self.times = np.asarray(self.read_times_binary(self.filename))
+
+    def prewarm(self, points: List[Point]):
+        """
+        Fills the snapping caches of both location sets with points expected to recur.
+        :param points:
+        """
+        self.origins.prewarm(points)
+        self.destinations.prewarm(points)
+
     def get_time(self, location1: Point, location2: Point):
         """
         Retrieves the travel time from the input base and demand point.
@@ -50,10 +165,54 @@ class TravelTimes:
         if dist2 > 0:
             raise Exception("Location 2 does not exist in location set 2")
 
-        time = int(self.times[index1][index2])
+        return self.get_time_by_index(index1, index2)
+
+    def get_time_by_index(self, origin_index: int, destination_index: int):
+        """
+        Retrieves the travel time between an origin and a destination given by their indices in the
+        location sets.
+
+        :param origin_index: Index of the location in the origin set
+        :param destination_index: Index of the location in the destination set
+        :return: The travel time as a timedelta
+        """
+
+        time = int(self.times[origin_index, destination_index])
 
         return timedelta(seconds=time)
 
+    def get_times_from_index(self, origin_index: int, destination_indices=None):
+        """
+        Retrieves the travel times from one origin to many destinations.
+
+        :param origin_index: Index of the location in the origin set
+        :param destination_indices: Indices of locations in the destination set; all destinations if None
+        :return: Array of travel times in whole seconds
+        """
+
+        times = self.times[origin_index]
+
+        if destination_indices is not None:
+            times = times[np.asarray(destination_indices, dtype=int)]
+
+        return times.astype(int)
+
+    def get_times_to_index(self, destination_index: int, origin_indices=None):
+        """
+        Retrieves the travel times from many origins to one destination.
+
+        :param destination_index: Index of the location in the destination set
+        :param origin_indices: Indices of locations in the origin set; all origins if None
+        :return: Array of travel times in whole seconds
+        """
+
+        times = self.times[:, destination_index]
+
+        if origin_indices is not None:
+            times = times[np.asarray(origin_indices, dtype=int)]
+
+        return times.astype(int)
+
     def read_times_df(self, filename):
         # Read travel travel_times from CSV file into a pandas dataframe
         # from IPython import embed;
@@ -63,3 +222,41 @@ class TravelTimes:
         travel_times_df = travel_times_df.values
 
         return travel_times_df
+
+    def read_times_binary(self, filename):
+        """
+        Opens a binary travel times file as a read-only memory map, so that startup does not depend on the size
+        of the matrix and processes reading the same file share its pages.
+        :param filename:
+        :return: The memory-mapped matrix
+        """
+
+        header = read_binary_header(filename)
+
+        rows, columns = header["shape"]
+        if rows != len(self.origins) or columns != len(self.destinations):
+            raise Exception("Travel times in {} are {}x{} but the location sets have {} and {} locations".format(
+                filename, rows, columns, len(self.origins), len(self.destinations)))
+
+        for key, location_set in [("origins", self.origins), ("destinations", self.destinations)]:
+            if header[key] is not None and header[key] != describe_location_set(location_set):
+                raise Exception("Travel times in {} were computed for different {}".format(filename, key))
+
+        return np.memmap(filename, dtype=np.dtype(header["dtype"]), mode='r',
+                         offset=BINARY_HEADER_SIZE, shape=(rows, columns))
+
+    def write_binary(self, filename):
+        """
+        Writes the travel times in the binary format, describing the origins and destinations in the header.
+        :param filename:
+        """
+
+        header = {"version": 1,
+                  "dtype": BINARY_DTYPE.str,
+                  "shape": list(self.times.shape),
+                  "origins": describe_location_set(self.origins),
+                  "destinations": describe_location_set(self.destinations)}
+
+        with open(filename, 'wb') as f:
+            write_binary_header(f, header)
+            f.write(np.ascontiguousarray(self.times, dtype=BINARY_DTYPE).tobytes())
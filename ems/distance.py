@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+from geopy.distance import geodesic
+
+# Mean radius of the earth in kilometers
+EARTH_RADIUS_KM = 6371.009
+
+
+# Distance backends. Each takes the latitudes and longitudes of origins and destinations in degrees, as numbers
+# or as numpy arrays that broadcast against each other, and returns the distances in kilometers.
+#
+# Error against the WGS-84 geodesic, measured on pairs of points up to 100 km apart at latitudes up to 60 degrees:
+# - geodesic: exact to machine precision (Karney's method, as geopy.distance.distance), but the slowest
+# - haversine: great circle distance on a sphere; ignores the flattening of the earth, so the relative error is
+#   at most 0.56% and 0.2-0.3% on average
+# - equirectangular: flat projection around the mean latitude; adds to the haversine error a relative error
+#   that grows with the square of the distance, at most 0.004% for these pairs. Not suitable for pairs far apart,
+#   near the poles or across the antimeridian
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+
+    a = np.sin((latitude2 - latitude1) / 2) ** 2 + \
+        np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def equirectangular_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+
+    x = (longitude2 - longitude1) * np.cos((latitude1 + latitude2) / 2)
+    y = latitude2 - latitude1
+    return EARTH_RADIUS_KM * np.hypot(x, y)
+
+
+def geodesic_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = np.broadcast_arrays(latitude1, longitude1, latitude2, longitude2)
+
+    distances = [geodesic((lat1, lon1), (lat2, lon2)).km for lat1, lon1, lat2, lon2 in
+                 zip(latitude1.ravel(), longitude1.ravel(), latitude2.ravel(), longitude2.ravel())]
+    return np.reshape(distances, latitude1.shape)
+
+
+# Scalar versions for one pair of points, which avoid the overhead of numpy on single numbers
+
+def haversine_km_scalar(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + \
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1)))
+
+
+def equirectangular_km_scalar(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+
+    x = (longitude2 - longitude1) * math.cos((latitude1 + latitude2) / 2)
+    y = latitude2 - latitude1
+    return EARTH_RADIUS_KM * math.hypot(x, y)
+
+
+def geodesic_km_scalar(latitude1, longitude1, latitude2, longitude2):
+    return geodesic((latitude1, longitude1), (latitude2, longitude2)).km
+
+
+DISTANCE_BACKENDS = {"geodesic": (geodesic_km, geodesic_km_scalar),
+                     "haversine": (haversine_km, haversine_km_scalar),
+                     "equirectangular": (equirectangular_km, equirectangular_km_scalar)}
+
+
+def distances_km(latitudes1, longitudes1, latitudes2, longitudes2, backend: str = "haversine"):
+    """
+    Computes the distances between many pairs of points at once.
+    :param latitudes1: Latitudes of the origins
+    :param longitudes1: Longitudes of the origins
+    :param latitudes2: Latitudes of the destinations
+    :param longitudes2: Longitudes of the destinations
+    :param backend: One of geodesic, haversine or equirectangular
+    :return: Array of the distances in kilometers
+    """
+
+    if backend not in DISTANCE_BACKENDS:
+        raise Exception("Unknown distance backend {}; expected one of {}".format(backend, list(DISTANCE_BACKENDS)))
+
+    return DISTANCE_BACKENDS[backend][0](latitudes1, longitudes1, latitudes2, longitudes2)
@@ -1,11 +1,13 @@
 import math
-import random
 from datetime import datetime, timedelta
 
-from geopy import Point
+import numpy as np
+from geopy import Point, units
 from geopy.distance import distance
 
 from ems.datasets.times import TravelTimes
+from ems.distance import DISTANCE_BACKENDS, distances_km
+from ems.generators.sampling import BlockSampler, random_generator
 from ems.models.ambulance import Ambulance
 
 
@@ -19,19 +21,50 @@ class DurationGenerator:
                  timestamp: datetime = None):
         raise NotImplementedError()
 
+    def generate_many(self,
+                      n: int,
+                      ambulance: Ambulance = None,
+                      destination: Point = None,
+                      timestamp: datetime = None):
+        """
+        Generates n durations for the same arguments.
+        :return: A list of durations
+        """
+        return [self.generate(ambulance, destination, timestamp)['duration'] for _ in range(n)]
 
+
+# Implementation of a duration generator that travels the distance between the ambulance and the destination at a
+# constant velocity. See ems.distance for the accuracy of each distance backend.
 class DistanceDurationGenerator(DurationGenerator):
 
-    def __init__(self, velocity):
+    def __init__(self, velocity, backend: str = "geodesic"):
+        """
+        :param velocity: Velocity in kilometers per second
+        :param backend: Distance computation; one of geodesic, haversine or equirectangular
+        """
+        if backend not in DISTANCE_BACKENDS:
+            raise Exception("Unknown distance backend {}; expected one of {}".format(backend, list(DISTANCE_BACKENDS)))
+
         self.velocity = velocity
+        self.backend = backend
+        self.distance_km = DISTANCE_BACKENDS[backend][1]
 
     def generate(self,
                  ambulance: Ambulance = None,
                  destination: Point = None,
                  timestamp: datetime = None):
-        distance_km = distance(ambulance.location, destination).km
+        distance_km = self.distance_km(ambulance.location.latitude, ambulance.location.longitude,
+                                       destination.latitude, destination.longitude)
         return {'duration': timedelta(seconds=int(distance_km / self.velocity))}
 
+    def durations(self, latitudes1, longitudes1, latitudes2, longitudes2):
+        """
+        Computes the durations between many pairs of points at once.
+        :return: Array of the durations in whole seconds, as timedelta64
+        """
+        distance_km = distances_km(latitudes1, longitudes1, latitudes2, longitudes2, backend=self.backend)
+        return (distance_km / self.velocity).astype(np.int64).astype('timedelta64[s]')
+
 
 class ConstantDurationGenerator(DurationGenerator):
 
@@ -52,16 +85,34 @@ class ConstantDurationGenerator(DurationGenerator):
 class PoissonDurationGenerator(DurationGenerator):
 
     def __init__(self,
-                 lmda: float):
+                 lmda: float,
+                 seed: int = None,
+                 block_size: int = 4096):
+        """
+        :param lmda: Rate of cases per minute
+        :param seed: Seed of the generator; drawn from the global numpy random stream if None
+        :param block_size: Number of durations drawn at once
+        """
         self.lmda = lmda
+        self.rng = random_generator(seed)
+        self.sampler = BlockSampler(self.draw, block_size)
+
+    def draw(self, n: int):
+        minutes = self.rng.exponential(1 / self.lmda, n)
+        return np.rint(minutes * 6e7).astype(np.int64).astype('timedelta64[us]').tolist()
 
     def generate(self,
                  ambulance: Ambulance = None,
                  destination: Point = None,
                  timestamp: datetime = None):
-        rand = -math.log(1.0 - random.random())
-        minutes_until_next = rand / self.lmda
-        return {'duration': timedelta(minutes=minutes_until_next)}
+        return {'duration': self.sampler.next()}
+
+    def generate_many(self,
+                      n: int,
+                      ambulance: Ambulance = None,
+                      destination: Point = None,
+                      timestamp: datetime = None):
+        return self.sampler.take(n)
 
 
 # Implementation of an event duration generator that uniformly selects a random duration between two bounds
@@ -69,29 +120,70 @@ class RandomDurationGenerator(DurationGenerator):
 
     def __init__(self,
                  lower_bound: float = 5,
-                 upper_bound: float = 20):
+                 upper_bound: float = 20,
+                 seed: int = None,
+                 block_size: int = 4096):
+        """
+        :param lower_bound: Shortest duration in minutes
+        :param upper_bound: Longest duration in minutes
+        :param seed: Seed of the generator; drawn from the global numpy random stream if None
+        :param block_size: Number of durations drawn at once
+        """
         self.lower_bound = timedelta(minutes=lower_bound)
         self.upper_bound = timedelta(minutes=upper_bound)
+        self.rng = random_generator(seed)
+        self.sampler = BlockSampler(self.draw, block_size)
+
+    def draw(self, n: int):
+        seconds_lower_bound = int(self.lower_bound.total_seconds())
+        seconds_upper_bound = int(self.upper_bound.total_seconds())
+
+        seconds = self.rng.integers(seconds_lower_bound, seconds_upper_bound, n, endpoint=True)
+        return seconds.astype('timedelta64[s]').tolist()
 
     def generate(self,
                  ambulance: Ambulance = None,
                  destination: Point = None,
                  timestamp: datetime = None):
-        seconds_lower_bound = self.lower_bound.total_seconds()
-        seconds_upper_bound = self.upper_bound.total_seconds()
-
-        duration_in_seconds = random.randint(seconds_lower_bound, seconds_upper_bound)
-
-        return {'duration': timedelta(seconds=duration_in_seconds)}
-
-
+        return {'duration': self.sampler.next()}
+
+    def generate_many(self,
+                      n: int,
+                      ambulance: Ambulance = None,
+                      destination: Point = None,
+                      timestamp: datetime = None):
+        return self.sampler.take(n)
+
+
+# Implementation of a duration generator that looks up the travel time between the snapped ambulance location and the
+# snapped destination. The snapping error compares the distance between the snapped points with the real distance:
+# - eager: computed for every event
+# - lazy: computed when the error of the event is first read
+# - batch: the points are recorded and the errors of all events are computed at once by errors()
+# - off: not computed
 class TravelTimeDurationGenerator(DurationGenerator):
 
+    ERROR_MODES = ("eager", "lazy", "batch", "off")
+
     def __init__(self,
                  travel_times: TravelTimes,
-                 epsilon: float):
+                 epsilon: float,
+                 error_mode: str = "lazy"):
+        """
+        :param travel_times:
+        :param epsilon: Added to the squared real distance when computing the snapping error
+        :param error_mode: When the snapping error is computed; one of eager, lazy, batch or off
+        """
+        if error_mode not in TravelTimeDurationGenerator.ERROR_MODES:
+            raise Exception("Unknown error mode {}; expected one of {}".format(
+                error_mode, list(TravelTimeDurationGenerator.ERROR_MODES)))
+
         self.travel_times = travel_times
         self.epsilon = epsilon
+        self.error_mode = error_mode
+
+        # Real and snapped origin and destination coordinates of each travel, in batch mode
+        self.error_points = []
 
     def generate(self,
                  ambulance: Ambulance = None,
@@ -99,19 +191,55 @@ class TravelTimeDurationGenerator(DurationGenerator):
                  timestamp: datetime = None):
         # Compute the point from first location set to the ambulance location
         loc_set_1 = self.travel_times.origins
-        closest_loc_to_orig, _, _ = loc_set_1.closest(ambulance.location)
+        orig_index = ambulance.location_index(loc_set_1)
 
         # Compute the point from the second location set to the destination
         loc_set_2 = self.travel_times.destinations
-        closest_loc_to_dest, _, _ = loc_set_2.closest(destination)
-
-        # Calculate the error as a percentage between the sim dist and the real dist
-        sim_dist = distance(closest_loc_to_dest, closest_loc_to_orig)
-        real_dist = distance(destination, ambulance.location)
-        difference = 100 * ((sim_dist.feet - real_dist.feet) * real_dist.feet) / (
-                    math.pow(real_dist.feet, 2) + self.epsilon)
+        closest_loc_to_dest, dest_index, _ = loc_set_2.closest(destination)
 
         # Return time lookup
-        return {'duration': self.travel_times.get_time(closest_loc_to_orig, closest_loc_to_dest),
-                'error': difference,
-                'sim_dest': closest_loc_to_dest}
+        result = {'duration': self.travel_times.get_time_by_index(orig_index, dest_index),
+                  'sim_dest': closest_loc_to_dest,
+                  'origin_index': orig_index,
+                  'destination_index': dest_index}
+
+        if self.error_mode != "off":
+            origin = ambulance.location
+            closest_loc_to_orig = loc_set_1.locations[orig_index]
+
+            if self.error_mode == "eager":
+                result['error'] = self.snapping_error(origin, closest_loc_to_orig, destination, closest_loc_to_dest)
+
+            elif self.error_mode == "lazy":
+                result['error'] = lambda: self.snapping_error(origin, closest_loc_to_orig,
+                                                              destination, closest_loc_to_dest)
+
+            else:
+                self.error_points.append((origin.latitude, origin.longitude,
+                                          closest_loc_to_orig.latitude, closest_loc_to_orig.longitude,
+                                          destination.latitude, destination.longitude,
+                                          closest_loc_to_dest.latitude, closest_loc_to_dest.longitude))
+
+        return result
+
+    def snapping_error(self, origin, closest_loc_to_orig, destination, closest_loc_to_dest):
+        """ :return: The error as a percentage between the sim dist and the real dist """
+
+        sim_dist = distance(closest_loc_to_dest, closest_loc_to_orig)
+        real_dist = distance(destination, origin)
+        return 100 * ((sim_dist.feet - real_dist.feet) * real_dist.feet) / (
+                math.pow(real_dist.feet, 2) + self.epsilon)
+
+    def errors(self, backend: str = "geodesic"):
+        """
+        Computes the snapping errors of the travels generated in batch mode, at once.
+        :param backend: Distance computation; one of geodesic, haversine or equirectangular
+        :return: Array of the errors as percentages, in the order the travels were generated
+        """
+
+        points = np.array(self.error_points, dtype=float).reshape(-1, 8).T
+
+        feet_per_km = units.feet(kilometers=1)
+        sim_dist = feet_per_km * distances_km(points[6], points[7], points[2], points[3], backend=backend)
+        real_dist = feet_per_km * distances_km(points[4], points[5], points[0], points[1], backend=backend)
+        return 100 * ((sim_dist - real_dist) * real_dist) / (real_dist ** 2 + self.epsilon)
@@ -3,12 +3,14 @@ import random
 from typing import List
 
 import numpy as np
+import shapely
 import yaml
 from geopy import Point
-from numpy.random import choice
 from shapely import geometry
 from shapely.ops import triangulate
 
+from ems.generators.sampling import AliasTable, BlockSampler, random_generator
+
 
 # Interface for a location generator
 class LocationGenerator:
@@ -16,6 +18,14 @@ class LocationGenerator:
     def generate(self, timestamp=None):
         raise NotImplementedError()
 
+    def generate_many(self, n, timestamp=None):
+        """
+        Generates n locations.
+        :return: Arrays of the latitudes and the longitudes
+        """
+        points = [self.generate(timestamp) for _ in range(n)]
+        return np.array([point.latitude for point in points]), np.array([point.longitude for point in points])
+
 
 # Implementation for a location generator that randomly selects a point uniformly from a circle with given
 # center and radius (in meters)
@@ -45,31 +55,87 @@ class CircleLocationGenerator(LocationGenerator):
         return degrees
 
 
+def triangulate_polygon(polygon):
+    """
+    Divides a polygon into triangles that cover exactly the polygon.
+    :param polygon:
+    :return: Array of the vertices of each triangle, of shape (triangles, 3, 2)
+    """
+
+    if hasattr(shapely, "constrained_delaunay_triangles"):
+        triangles = shapely.constrained_delaunay_triangles(polygon).geoms
+
+    # Older versions of shapely only triangulate the convex hull of the vertices, so the triangles outside the
+    # polygon are dropped. This is exact for convex polygons only.
+    else:
+        triangles = [triangle for triangle in triangulate(polygon) if polygon.contains(triangle.centroid)]
+
+    return np.array([triangle.exterior.coords[:3] for triangle in triangles])
+
+
+def triangle_areas(triangles):
+    """
+    :param triangles: Array of the vertices of each triangle, of shape (triangles, 3, 2)
+    :return: Array of the area of each triangle
+    """
+    u = triangles[:, 1] - triangles[:, 0]
+    v = triangles[:, 2] - triangles[:, 0]
+    return np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]) / 2
+
+
 class PolygonLocationGenerator(LocationGenerator):
 
     def __init__(self,
                  vertices_longitude: List[float],
                  vertices_latitude: List[float],
+                 seed: int = None,
+                 block_size: int = 1024
                  ):
+        """
+        :param vertices_longitude:
+        :param vertices_latitude:
+        :param seed: Seed of the generator; drawn from the global numpy random stream if None
+        :param block_size: Number of locations drawn at once by generate
+        """
         self.vertices_latitude = vertices_latitude
         self.vertices_longitude = vertices_longitude
         self.polygon = geometry.Polygon([(latitude, longitude) for latitude, longitude in
                                          zip(vertices_latitude, vertices_longitude)])
 
-    def generate(self, timestamp=None):
-        triangles = triangulate(self.polygon)
-        areas = [triangle.area for triangle in triangles]
-        areas_normalized = [triangle.area / sum(areas) for triangle in triangles]
+        # The polygon does not change: triangulate it and weigh the triangles by their area once
+        self.triangles = triangulate_polygon(self.polygon)
+        self.triangle_table = AliasTable(triangle_areas(self.triangles))
 
-        t = np.random.choice(triangles, p=areas_normalized)
-        a, b = sorted([random.random(), random.random()])
+        self.rng = random_generator(seed)
+        self.sampler = BlockSampler(self.draw, block_size)
 
-        coords = t.exterior.coords
+    def sample(self, rng: np.random.Generator, n: int):
+        """
+        Draws locations uniformly from the polygon.
+        :param rng:
+        :param n:
+        :return: Arrays of the latitudes and the longitudes
+        """
 
-        lat = a * coords[0][0] + (b - a) * coords[1][0] + (1 - b) * coords[2][0]
-        long = a * coords[0][1] + (b - a) * coords[1][1] + (1 - b) * coords[2][1]
+        coords = self.triangles[self.triangle_table.sample(rng, n)]
 
-        return Point(latitude=lat, longitude=long)
+        # Uniform point in each triangle
+        a, b = np.sort(rng.random((n, 2)), axis=1).T
+        weights = np.stack([a, b - a, 1 - b], axis=1)
+        points = np.einsum('ij,ijk->ik', weights, coords)
+
+        return points[:, 0], points[:, 1]
+
+    def draw(self, n: int):
+        latitudes, longitudes = self.sample(self.rng, n)
+        return [Point(latitude=latitude, longitude=longitude)
+                for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist())]
+
+    def generate(self, timestamp=None):
+        return self.sampler.next()
+
+    def generate_many(self, n, timestamp=None):
+        return self.sample(self.rng, n)
 
 
 class MultiPolygonLocationGenerator(LocationGenerator):
@@ -83,11 +149,15 @@ class MultiPolygonLocationGenerator(LocationGenerator):
                  latitudes: List[List[float]] = None,
                  longitudes_file: str = None,
                  latitudes_file: str = None,
-                 densities: List[float] = None):
+                 densities: List[float] = None,
+                 seed: int = None,
+                 block_size: int = 1024):
         """
         Asserts correct assumptions about multi-polygon, like sum(probabilities) = 100 %
         :param polygons: Set of polygons denoted as a list of list of points.
         :param densities: The probability for each polygon respectively to each polygon.
+        :param seed: Seed of the generator; drawn from the global numpy random stream if None
+        :param block_size: Number of locations drawn at once by generate
         """
 
         if not any([latitudes and longitudes, longitudes_file and latitudes_file]):
@@ -108,14 +178,40 @@ class MultiPolygonLocationGenerator(LocationGenerator):
             self.densities = densities
 
         # Validate function args
-        if sum(densities) != 1.0:
+        if not math.isclose(sum(self.densities), 1.0):
             raise Exception("Sum of densities should add up to 100%")
-        if len(densities) != len(longitudes):
+        if len(self.densities) != len(longitudes):
             raise Exception("Provided polygons and densities are not equal in length")
 
         # self.polygon_generators = self.create_generators(each_polygons_longitudes, each_polygons_latitudes)
         self.polygon_generators = [PolygonLocationGenerator(longitudes[i], latitudes[i])
                                    for i in range(len(longitudes))]
+        self.polygon_table = AliasTable(self.densities)
+
+        self.rng = random_generator(seed)
+        self.sampler = BlockSampler(self.draw, block_size)
+
+    def sample(self, rng: np.random.Generator, n: int):
+        """
+        Chooses a polygon for each location based on the probability distribution, then draws the
+        locations of each polygon at once.
+        :return: Arrays of the latitudes and the longitudes
+        """
+
+        polygon_indices = self.polygon_table.sample(rng, n)
+
+        latitudes = np.empty(n)
+        longitudes = np.empty(n)
+        for index, generator in enumerate(self.polygon_generators):
+            in_polygon = polygon_indices == index
+            latitudes[in_polygon], longitudes[in_polygon] = generator.sample(rng, int(np.count_nonzero(in_polygon)))
+
+        return latitudes, longitudes
+
+    def draw(self, n: int):
+        latitudes, longitudes = self.sample(self.rng, n)
+        return [Point(latitude=latitude, longitude=longitude)
+                for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist())]
 
     def generate(self, timestamp=None):
         """
@@ -124,5 +220,7 @@ class MultiPolygonLocationGenerator(LocationGenerator):
         :param timestamp: The time at which this case starts
         :return:
         """
-        generator = choice(self.polygon_generators, 1, p=self.densities)[0]
-        return generator.generate(timestamp)
+        return self.sampler.next()
+
+    def generate_many(self, n, timestamp=None):
+        return self.sample(self.rng, n)
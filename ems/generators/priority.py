@@ -1,4 +1,4 @@
-from numpy.random import choice
+from ems.generators.sampling import BlockSampler, random_generator
 
 
 # Interface for a priority generator
@@ -10,11 +10,24 @@ class PriorityGenerator:
     def generate(self, timestamp=None):
         raise NotImplementedError()
 
+    def generate_many(self, n, timestamp=None):
+        """
+        Generates n priorities.
+        :return: A list of priorities
+        """
+        return [self.generate(timestamp) for _ in range(n)]
+
 
 # Generates a priority from a probabilistic distribution
 class RandomPriorityGenerator(PriorityGenerator):
 
-    def __init__(self, priorities=None, distribution=None):
+    def __init__(self, priorities=None, distribution=None, seed=None, block_size=4096):
+        """
+        :param priorities:
+        :param distribution: Probability of each priority; uniform if None
+        :param seed: Seed of the generator; drawn from the global numpy random stream if None
+        :param block_size: Number of priorities drawn at once
+        """
         super().__init__(priorities=priorities)
 
         if priorities is None:
@@ -32,6 +45,16 @@ class RandomPriorityGenerator(PriorityGenerator):
         if len(self.dist) != len(priorities):
             raise Exception("Provided dist and priorities are not equal in length")
 
+        # The distribution is validated and normalized by numpy once per block rather than once per priority
+        self.rng = random_generator(seed)
+        self.sampler = BlockSampler(self.draw, block_size)
+
+    def draw(self, n):
+        return self.rng.choice(self.priorities, n, p=self.dist).tolist()
+
     def generate(self, timestamp=None):
         # Randomly choose
-        return choice(self.priorities, 1, p=self.dist)[0]
+        return self.sampler.next()
+
+    def generate_many(self, n, timestamp=None):
+        return self.sampler.take(n)
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def random_generator(seed=None):
+    """
+    Creates a numpy random generator. Without a seed, the generator is seeded from the global numpy
+    random stream, so that seeding numpy before creating the generators reproduces a simulation.
+    :param seed:
+    :return: The generator
+    """
+
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 32, size=4)
+
+    return np.random.default_rng(seed)
+
+
+# Hands out samples one at a time from blocks drawn by a vectorized sampling function
+class BlockSampler:
+
+    def __init__(self, draw, block_size: int = 4096):
+        """
+        :param draw: Function that takes a number of samples and returns them as a list
+        :param block_size: Number of samples drawn at once
+        """
+        self.draw = draw
+        self.block_size = block_size
+        self.block = []
+        self.position = 0
+
+    def next(self):
+        if self.position == len(self.block):
+            self.block = self.draw(self.block_size)
+            self.position = 0
+
+        sample = self.block[self.position]
+        self.position += 1
+        return sample
+
+    def take(self, n: int):
+        """
+        Returns the next n samples. The samples left in the current block are used first, so that the
+        samples are the same however they are requested.
+        :param n:
+        :return: A list of samples
+        """
+
+        samples = self.block[self.position:self.position + n]
+        self.position += len(samples)
+
+        if len(samples) < n:
+            samples = samples + self.draw(n - len(samples))
+
+        return samples
+
+
+# Walker's alias method: samples an index with probability proportional to its weight in constant time
+class AliasTable:
+
+    def __init__(self, weights):
+        """
+        :param weights: Non-negative weight of each index
+        """
+        weights = np.asarray(weights, dtype=float)
+        scaled = weights / weights.sum() * len(weights)
+
+        # Probability of keeping the drawn index rather than its alias
+        self.probability = np.ones(len(weights))
+        self.alias = np.arange(len(weights))
+
+        small = [index for index in range(len(weights)) if scaled[index] < 1]
+        large = [index for index in range(len(weights)) if scaled[index] >= 1]
+
+        # Fill the remainder of each small column with a large index
+        while small and large:
+            index = small.pop()
+            alias = large.pop()
+            self.probability[index] = scaled[index]
+            self.alias[index] = alias
+
+            scaled[alias] += scaled[index] - 1
+            if scaled[alias] < 1:
+                small.append(alias)
+            else:
+                large.append(alias)
+
+    def __len__(self):
+        return len(self.probability)
+
+    def sample(self, rng: np.random.Generator, n: int):
+        """
+        :param rng:
+        :param n:
+        :return: An array of n indices
+        """
+        columns = rng.integers(0, len(self.probability), n)
+        keep = rng.random(n) < self.probability[columns]
+        return np.where(keep, columns, self.alias[columns])
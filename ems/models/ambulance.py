@@ -18,6 +18,32 @@ class Ambulance:
         self.deployed = deployed
         self.location = location
 
+    @property
+    def location(self):
+        return self._location
+
+    @location.setter
+    def location(self, location: Point):
+
+        # Snapped indices of the current location, cached per location set and kept while the ambulance stays put
+        if getattr(self, "_location", None) is not location:
+            self.location_indices = {}
+
+        self._location = location
+
+    def location_index(self, location_set):
+        """
+        Finds the index of the point in the location set closest to the ambulance location. The
+        result is cached until the ambulance moves.
+        :param location_set:
+        :return: The index of the closest point
+        """
+
+        if location_set not in self.location_indices:
+            self.location_indices[location_set] = location_set.closest(self.location)[1]
+
+        return self.location_indices[location_set]
+
     def __eq__(self, other):
         """
         Checks for equality
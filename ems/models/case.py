@@ -20,6 +20,30 @@ class Case:
         self.incident_location = incident_location
         self.priority = priority
 
+    @property
+    def incident_location(self):
+        return self._incident_location
+
+    @incident_location.setter
+    def incident_location(self, incident_location: Point):
+        self._incident_location = incident_location
+
+        # Snapped indices of the incident location, cached per location set
+        self.incident_location_indices = {}
+
+    def incident_location_index(self, location_set):
+        """
+        Finds the index of the point in the location set closest to the incident location. The
+        result is cached with the case.
+        :param location_set:
+        :return: The index of the closest point
+        """
+
+        if location_set not in self.incident_location_indices:
+            self.incident_location_indices[location_set] = location_set.closest(self.incident_location)[1]
+
+        return self.incident_location_indices[location_set]
+
     def iterator(self, ambulance, current_time):
         raise NotImplementedError()
 
@@ -23,8 +23,25 @@ class Event:
                  duration: timedelta = None,
                  error=None,
                  sim_dest=None):
+        """
+        :param destination:
+        :param event_type:
+        :param duration:
+        :param error: Snapping error of the duration, or a function computing it when first accessed
+        :param sim_dest: Snapped destination
+        """
         self.destination = destination
         self.event_type = event_type
         self.duration = duration
         self.error = error
         self.sim_dest = sim_dest
+
+    @property
+    def error(self):
+        if callable(self._error):
+            self._error = self._error()
+        return self._error
+
+    @error.setter
+    def error(self, error):
+        self._error = error
@@ -0,0 +1,141 @@
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+from ems.algorithms.ambulance import AmbulanceSelector
+from ems.algorithms.hospital import HospitalSelector
+from ems.analysis.metric import MetricAggregator
+from ems.analysis.record import CaseRecordSet
+from ems.datasets.case import CaseSet
+from ems.datasets.location import LocationSet
+from ems.datasets.times import TravelTimes
+from ems.generators.duration import DurationGenerator
+
+
+class Profiler:
+    """
+    Measures the wall time and number of calls spent in each phase of a simulation. While active, the profiler
+    wraps the methods of each phase in the given classes and all of their subclasses. Times are inclusive:
+    a travel time lookup that snaps locations also counts towards location snapping.
+    """
+
+    # Phase name, base classes and method names
+    PHASES = [("case_generation", [CaseSet], ["iterator"]),
+              ("ambulance_selection", [AmbulanceSelector], ["select_ambulance"]),
+              ("hospital_selection", [HospitalSelector], ["select"]),
+              ("duration_generation", [DurationGenerator], ["generate"]),
+              ("travel_time_lookup", [TravelTimes], ["get_time", "get_time_by_index",
+                                                     "get_times_from_index", "get_times_to_index"]),
+              ("location_snapping", [LocationSet], ["closest"]),
+              ("metric_calculation", [MetricAggregator], ["calculate"]),
+              ("record_keeping", [CaseRecordSet], ["add_case_record"])]
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.depths = {}
+        self.originals = []
+        self.phases = [name for name, _, _ in Profiler.PHASES]
+
+        for name in self.phases:
+            self.add_phase(name)
+
+    def add_phase(self, name):
+        if name not in self.calls:
+            self.calls[name] = 0
+            self.seconds[name] = 0.0
+            self.depths[name] = 0
+
+    def __enter__(self):
+        for name, base_classes, method_names in Profiler.PHASES:
+            for cls in Profiler.subclasses(base_classes):
+                for method_name in method_names:
+                    if method_name in vars(cls):
+                        original = vars(cls)[method_name]
+                        self.originals.append((cls, method_name, original))
+                        setattr(cls, method_name, self.wrap(name, original, generator=method_name == "iterator"))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for cls, method_name, original in reversed(self.originals):
+            setattr(cls, method_name, original)
+        self.originals = []
+
+    @staticmethod
+    def subclasses(base_classes):
+        classes = []
+        pending = list(base_classes)
+        while pending:
+            cls = pending.pop()
+            if cls not in classes:
+                classes.append(cls)
+                pending.extend(cls.__subclasses__())
+        return classes
+
+    @contextmanager
+    def phase(self, name):
+        """ Times a block of code as one call of the named phase. Nested calls of a phase are not counted twice. """
+
+        self.add_phase(name)
+
+        if self.depths[name] > 0:
+            yield
+            return
+
+        self.depths[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            self.depths[name] -= 1
+
+    def wrap(self, name, function, generator=False):
+
+        if generator:
+            # Time each step of the returned iterator rather than its creation
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                iterator = function(*args, **kwargs)
+                while True:
+                    with self.phase(name):
+                        item = next(iterator, StopIteration)
+                    if item is StopIteration:
+                        return
+                    yield item
+
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    def results(self):
+        return {name: {"calls": self.calls[name],
+                       "total_seconds": self.seconds[name],
+                       "mean_seconds": self.seconds[name] / self.calls[name] if self.calls[name] else 0.0}
+                for name in self.calls}
+
+    def summary(self, total: str = "simulation"):
+        """
+        :param total: The phase whose time the other phases are given as a percentage of
+        :return: A table of the phases
+        """
+
+        total_seconds = self.seconds.get(total, 0.0)
+
+        lines = ["{:<22} {:>10} {:>12} {:>14} {:>8}".format("phase", "calls", "total (s)", "mean (us)", "%")]
+        for name, result in self.results().items():
+            percent = 100 * result["total_seconds"] / total_seconds if total_seconds else 0.0
+            lines.append("{:<22} {:>10} {:>12.3f} {:>14.2f} {:>8.1f}".format(
+                name, result["calls"], result["total_seconds"], result["mean_seconds"] * 1e6, percent))
+
+        return "\n".join(lines)
+
+    def write_to_file(self, output_filename):
+        with open(output_filename, 'w') as f:
+            json.dump(self.results(), f, indent=2)
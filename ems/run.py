@@ -1,32 +1,95 @@
 import importlib
+import random
+from multiprocessing import Pool
+from typing import List
+
+import numpy as np
+import pandas as pd
 import yaml
+from scipy import stats
+
+from ems.artifacts import ArtifactCache
+from ems.datasets.ambulance import AmbulanceSet
+from ems.datasets.hospital import HospitalSet
+from ems.datasets.times import TravelTimes
+from ems.profiling import Profiler
 
 
 class Driver:
 
-    def __init__(self, config_location='', **kwargs):
+    def __init__(self, config_location='', artifact_cache: ArtifactCache = None, **kwargs):
+        """
+        :param config_location: YAML configuration file
+        :param artifact_cache: Restores the expensive objects of previous runs built from the same inputs
+        :param kwargs: Configuration, in addition to the file
+        """
         if config_location:
             kwargs.update(yaml.load(open(config_location, 'r')))
         self.params = kwargs
+        self.artifact_cache = artifact_cache
 
     def create_simulator(self):
-        data = Driver._create_objects(self.params)
+        data = Driver._create_objects(self.params, self.artifact_cache)
+        Driver._prewarm_snapping(data)
         sim = data.pop('simulator')
         return sim, data
 
+    @staticmethod
+    def _prewarm_snapping(objects):
+        """
+        Ambulances keep returning to their bases and to the hospitals: snap these points onto every set of travel
+        times once, at load time, so that the simulation finds them in the snapping caches.
+        """
+
+        points = []
+        for obj in objects.values():
+            if isinstance(obj, AmbulanceSet):
+                points.extend(ambulance.base for ambulance in obj.ambulances)
+            elif isinstance(obj, HospitalSet):
+                points.extend(obj.locations)
+
+        for obj in objects.values():
+            if isinstance(obj, TravelTimes):
+                obj.prewarm(points)
+
+    def run_simulator(self, profiler: Profiler = None):
+        """
+        Creates and runs the simulator.
+        :param profiler: If given, times the setup and each phase of the simulation
+        :return: The finished simulator and the other created objects
+        """
+
+        if profiler is None:
+            sim, data = self.create_simulator()
+            sim.run()
+            return sim, data
+
+        with profiler.phase("setup"):
+            sim, data = self.create_simulator()
+
+        # The configured classes are imported by now, so their methods are instrumented as well
+        with profiler, profiler.phase("simulation"):
+            sim.run()
+
+        return sim, data
+
     # If key in d already exists in self.objects, overwrites it
     @staticmethod
-    def _create_objects(params):
+    def _create_objects(params, artifact_cache: ArtifactCache = None):
 
         # Parse objects and store
         objects = {}
+
+        # Artifact keys of the created objects, by object id
+        object_keys = {}
+
         for key, value in params.items():
-            objects[key] = Driver._create_recurse(value, objects)
+            objects[key] = Driver._create_recurse(value, objects, artifact_cache, object_keys)
 
         return objects
 
     @staticmethod
-    def _create_recurse(param, objects):
+    def _create_recurse(param, objects, artifact_cache: ArtifactCache = None, object_keys=None):
         """
         For each item in the YAML file that has a classpath and classname, instantiate the
         respective module and class object. This method uses recursion to traverse the nested
@@ -47,16 +110,21 @@ class Driver:
 
                 # Parameter: recurse to create object for parameter
                 else:
-                    params[key] = Driver._create_recurse(value, objects)
+                    params[key] = Driver._create_recurse(value, objects, artifact_cache, object_keys)
 
             # print("Instantiating: {}".format(cname)) # TODO Change to log
             c = getattr(importlib.import_module(cpath), cname)
-            instance = c(**params)
+
+            if artifact_cache is None:
+                instance = c(**params)
+            else:
+                instance = Driver._create_cached(c, params, artifact_cache, object_keys)
+
             return instance
 
         # List of objects
         elif isinstance(param, list):
-            return [Driver._create_recurse(ele, objects) for ele in param]
+            return [Driver._create_recurse(ele, objects, artifact_cache, object_keys) for ele in param]
 
         # If key pointing to existing object
         elif isinstance(param, str) and param[0] == "$":
@@ -66,6 +134,184 @@ class Driver:
         else:
             return param
 
+    @staticmethod
+    def _create_cached(c, params, artifact_cache: ArtifactCache, object_keys):
+        """
+        Restores an object of a class marked as cacheable from the artifact cache, or creates and stores it.
+        Other objects are always created, but are given a key so that the objects built from them are cached.
+        """
+
+        key = artifact_cache.key(c, params, object_keys)
+
+        if getattr(c, "cacheable", False):
+            external_objects = {object_keys[id(obj)]: obj for obj in Driver._created_objects(params, object_keys)}
+
+            instance = artifact_cache.load(c, key, external_objects)
+            if instance is None:
+                instance = c(**params)
+                artifact_cache.store(c, key, instance, external_objects)
+
+            # Restored objects may redo the side effects of their constructor
+            elif hasattr(instance, "restored"):
+                instance.restored()
+
+        else:
+            instance = c(**params)
+
+        object_keys[id(instance)] = key
+        return instance
+
+    @staticmethod
+    def _created_objects(param, object_keys):
+        """ :return: The objects created by the Driver among the parameters """
+
+        if id(param) in object_keys:
+            return [param]
+        if isinstance(param, dict):
+            return [obj for value in param.values() for obj in Driver._created_objects(value, object_keys)]
+        if isinstance(param, list):
+            return [obj for value in param for obj in Driver._created_objects(value, object_keys)]
+        return []
+
+
+def seed_replication(seed: int):
+    """
+    Seeds the random and numpy.random streams used by the generators for one replication. The numpy
+    seed is derived from the replication seed so that the two streams are independent.
+    :param seed:
+    """
+    random.seed(seed)
+    np.random.seed(np.random.SeedSequence(seed).generate_state(1)[0])
+
+
+def run_replication(params: dict, seed: int, artifact_cache: ArtifactCache = None):
+    """
+    Creates and runs one simulation with its own seeded random streams.
+    :param params: The simulation configuration
+    :param seed: The replication seed
+    :param artifact_cache: Restores the expensive objects built by previous replications
+    :return: The simulated cases and the metrics as dataframes
+    """
+
+    seed_replication(seed)
+
+    sim, data = Driver(artifact_cache=artifact_cache, **params).create_simulator()
+    case_record_set = sim.run()
+
+    cases_df = case_record_set.to_dataframe()
+    metrics_df = sim.metric_aggregator.to_dataframe() if sim.metric_aggregator is not None else pd.DataFrame()
+
+    return cases_df, metrics_df
+
+
+class ReplicationRunner:
+    """
+    Runs independent replications of one simulation configuration across a process pool, one
+    replication per seed, and merges their results.
+    """
+
+    def __init__(self,
+                 seeds: List[int],
+                 config_location='',
+                 processes: int = None,
+                 confidence: float = 0.95,
+                 artifact_cache: ArtifactCache = None,
+                 **kwargs):
+
+        # Results are grouped by seed: a repeated seed would merge two identical replications into one
+        if len(set(seeds)) != len(seeds):
+            raise Exception("Replication seeds must be distinct: {}".format(seeds))
+
+        self.seeds = seeds
+        self.params = Driver(config_location, **kwargs).params
+        self.processes = processes
+        self.confidence = confidence
+        self.artifact_cache = artifact_cache
+
+    def run(self):
+
+        with Pool(self.processes) as p:
+            replications = p.starmap(run_replication,
+                                     [(self.params, seed, self.artifact_cache) for seed in self.seeds])
+
+        return ReplicationResults(seeds=self.seeds,
+                                  replications=replications,
+                                  confidence=self.confidence)
+
+
+class ReplicationResults:
+
+    def __init__(self,
+                 seeds: List[int],
+                 replications: list,
+                 confidence: float = 0.95):
+        self.seeds = seeds
+        self.confidence = confidence
+
+        # Merge the replications, labelled by their seed
+        self.cases = pd.concat([cases_df.assign(replication=seed)
+                                for seed, (cases_df, _) in zip(seeds, replications)], ignore_index=True)
+        self.metrics = pd.concat([metrics_df.assign(replication=seed)
+                                  for seed, (_, metrics_df) in zip(seeds, replications)], ignore_index=True)
+
+        self.statistics = self.replication_statistics()
+        self.summary = self.confidence_intervals()
+
+    def replication_statistics(self):
+        """
+        Reduces every replication to one value per statistic: the number of cases, the mean duration
+        of each event type in seconds and the mean of each metric over the run.
+        :return: A dataframe with one row per replication
+        """
+
+        cases = self.cases.groupby("replication", sort=False)
+        statistics = pd.DataFrame({"cases": cases.size()})
+        for column in self.cases.columns:
+            if column.endswith("_duration"):
+                statistics[column] = cases[column].apply(lambda d: pd.to_timedelta(d).dt.total_seconds().mean())
+
+        metrics = self.metrics.groupby("replication", sort=False)
+        for column in self.metrics.columns:
+            if column not in ("timestamp", "replication"):
+                statistics[column] = metrics[column].apply(ReplicationResults.mean_value)
+
+        return statistics.reindex(self.seeds)
+
+    def confidence_intervals(self):
+        """
+        Computes the mean of each statistic across replications with a Student's t confidence interval.
+        :return: A dataframe with one row per statistic
+        """
+
+        n = len(self.statistics)
+        mean = self.statistics.mean()
+        std = self.statistics.std(ddof=1)
+
+        if n > 1:
+            half_width = stats.t.ppf((1 + self.confidence) / 2, n - 1) * std / np.sqrt(n)
+        else:
+            half_width = std * np.nan
+
+        return pd.DataFrame({"mean": mean,
+                             "std": std,
+                             "ci_lower": mean - half_width,
+                             "ci_upper": mean + half_width,
+                             "replications": n})
+
+    @staticmethod
+    def mean_value(values):
+        # Durations such as the total delay are averaged in seconds
+        if pd.api.types.is_timedelta64_dtype(values):
+            return values.dt.total_seconds().mean()
+
+        return pd.to_numeric(values, errors='coerce').mean()
+
+    def write_to_file(self, output_dir):
+        self.cases.to_csv(output_dir + '/simulated_cases.csv', index=False)
+        self.metrics.to_csv(output_dir + '/metrics.csv', index=False)
+        self.statistics.to_csv(output_dir + '/replications.csv', index_label="replication")
+        self.summary.to_csv(output_dir + '/summary.csv', index_label="statistic")
+
 
 # if __name__ == "__main__":
 #
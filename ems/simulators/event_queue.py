@@ -0,0 +1,90 @@
+import bisect
+import heapq
+from datetime import datetime
+from itertools import count
+
+
+# Interface for the queue of ongoing case states ordered by the time of their next event
+class EventQueue:
+    """
+    Users may subclass to implement their own event queue. Items with equal times must be
+    returned in a deterministic order; the default implementations return the most recently
+    pushed item first, which is the order the simulator has always used.
+    """
+
+    def push(self, time: datetime, item):
+        raise NotImplementedError()
+
+    def pop(self):
+        raise NotImplementedError()
+
+    def peek_time(self):
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __iter__(self):
+        raise NotImplementedError()
+
+    def ordered_items(self):
+        """ :return: A list of the queued items in the order they would be popped """
+        raise NotImplementedError()
+
+
+# Implementation of an event queue as a binary heap. Push and pop are O(log n).
+class HeapEventQueue(EventQueue):
+
+    def __init__(self):
+        self.heap = []
+
+        # Decreasing sequence numbers break ties in favour of the latest push
+        self.sequence = count(0, -1)
+
+    def push(self, time: datetime, item):
+        heapq.heappush(self.heap, (time, next(self.sequence), item))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def peek_time(self):
+        return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        """ Iterates over the queued items in no particular order. """
+        return (entry[2] for entry in self.heap)
+
+    def ordered_items(self):
+        return [entry[2] for entry in sorted(self.heap, key=lambda entry: entry[:2])]
+
+
+# Implementation of an event queue as a sorted list. Push and pop are O(n); kept for comparison.
+class SortedListEventQueue(EventQueue):
+
+    def __init__(self):
+        self.times = []
+        self.items = []
+
+    def push(self, time: datetime, item):
+        index = bisect.bisect_left(self.times, time)
+        self.times.insert(index, time)
+        self.items.insert(index, item)
+
+    def pop(self):
+        self.times.pop(0)
+        return self.items.pop(0)
+
+    def peek_time(self):
+        return self.times[0] if self.times else None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def ordered_items(self):
+        return list(self.items)
@@ -0,0 +1,50 @@
+import bisect
+from typing import List
+
+from ems.models.ambulance import Ambulance
+
+
+# Index of the idle ambulances in a fleet, updated only when an ambulance is deployed or freed. Deploying or freeing
+# an ambulance costs a bisect and a list insertion or deletion, O(log n + n) with a small constant; the idle
+# ambulances are handed out as a tuple, built at most once per change, so that callers cannot modify the index.
+class FleetStatus:
+
+    def __init__(self, ambulances: List[Ambulance]):
+        self.ambulances = ambulances
+        self.positions = {ambulance: position for position, ambulance in enumerate(ambulances)}
+
+        # Idle ambulances and their positions in the fleet, kept in fleet order
+        self.idle_positions = [position for position, ambulance in enumerate(ambulances) if not ambulance.deployed]
+        self.idle_ambulances = [self.ambulances[position] for position in self.idle_positions]
+        self.idle_snapshot = None
+
+    @property
+    def idle(self):
+        """ :return: The idle ambulances in fleet order, as a tuple """
+        if self.idle_snapshot is None:
+            self.idle_snapshot = tuple(self.idle_ambulances)
+        return self.idle_snapshot
+
+    def deploy(self, ambulance: Ambulance):
+        position = self.positions[ambulance]
+        index = bisect.bisect_left(self.idle_positions, position)
+
+        if index == len(self.idle_positions) or self.idle_positions[index] != position:
+            raise Exception("Ambulance {} is not idle".format(ambulance.id))
+
+        ambulance.deployed = True
+        del self.idle_positions[index]
+        del self.idle_ambulances[index]
+        self.idle_snapshot = None
+
+    def free(self, ambulance: Ambulance):
+        position = self.positions[ambulance]
+        index = bisect.bisect_left(self.idle_positions, position)
+
+        if index < len(self.idle_positions) and self.idle_positions[index] == position:
+            raise Exception("Ambulance {} is already idle".format(ambulance.id))
+
+        ambulance.deployed = False
+        self.idle_positions.insert(index, position)
+        self.idle_ambulances.insert(index, ambulance)
+        self.idle_snapshot = None
@@ -1,15 +1,16 @@
-import bisect
+from collections import deque
 from datetime import datetime
 
-# TODO -- remove dependency on colored library
-from termcolor import colored
-
 from ems.algorithms.ambulance import AmbulanceSelector
-from ems.analysis.metric import MetricAggregator
+from ems.analysis.metric import MetricAggregator, StateChange
 from ems.analysis.record import CaseRecordSet, CaseRecord
 from ems.datasets.ambulance import AmbulanceSet
 from ems.datasets.case import CaseSet
 from ems.models.case import Case
+from ems.simulators.event_queue import EventQueue, HeapEventQueue
+from ems.simulators.fleet import FleetStatus
+from ems.simulators.tracing import Tracer, TerminalTraceSink, TraceCategory, CaseProcessed, AmbulanceSelected, \
+    EventProcessed, EventStarted, EventFinished, CaseFinished, StateTraced, MetricsComputed
 
 
 class Simulator:
@@ -61,13 +62,34 @@ class EventDispatcherSimulator(Simulator):
                  cases: CaseSet,
                  ambulance_selector: AmbulanceSelector,
                  metric_aggregator: MetricAggregator = None,
-                 debug: bool = False):
+                 debug: bool = False,
+                 event_queue: EventQueue = None,
+                 case_record_set: CaseRecordSet = None,
+                 tracer: Tracer = None):
         super().__init__(ambulances, cases, ambulance_selector, metric_aggregator, debug)
-        self.case_record_set = CaseRecordSet()
 
-    def print(self, o):
-        if self.debug:
-            print(o)
+        # Debugging prints every trace record to the terminal
+        if tracer is None and debug:
+            tracer = Tracer(sinks=[TerminalTraceSink()])
+
+        self.tracer = tracer
+
+        # Trace records are only built for the traced categories
+        self.trace_dispatch = tracer is not None and tracer.traces(TraceCategory.DISPATCH)
+        self.trace_event = tracer is not None and tracer.traces(TraceCategory.EVENT)
+        self.trace_state = tracer is not None and tracer.traces(TraceCategory.STATE)
+        self.trace_metric = tracer is not None and tracer.traces(TraceCategory.METRIC)
+
+        if case_record_set is None:
+            case_record_set = CaseRecordSet()
+
+        self.case_record_set = case_record_set
+        self.fleet = None
+
+        if event_queue is None:
+            event_queue = HeapEventQueue()
+
+        self.event_queue = event_queue
 
     def run(self):
 
@@ -75,45 +97,55 @@ class EventDispatcherSimulator(Simulator):
         for ambulance in ambulances:
             ambulance.location = ambulance.base
         case_iterator = self.cases.iterator()
-        pending_cases = []
-        ongoing_case_states = []
+        pending_cases = deque()
+        ongoing_case_states = self.event_queue
         current_time = None
 
+        # The available ambulances are only updated when an ambulance is deployed or freed
+        self.fleet = FleetStatus(ambulances)
+
         # Initialize next case
         next_case = next(case_iterator)
 
         while len(ongoing_case_states) or next_case:
 
-            next_ongoing_case_state_dt = ongoing_case_states[0].next_event_time if ongoing_case_states else datetime.max
-            available_ambulances = [ambulance for ambulance in ambulances if not ambulance.deployed]
+            next_ongoing_case_state_dt = ongoing_case_states.peek_time() if ongoing_case_states else datetime.max
+            previous_time = current_time
+
+            # State changes during this iteration, which decide the metrics to evaluate
+            changes = set()
 
             # Process a pending case
-            if pending_cases and available_ambulances:
+            if pending_cases and self.fleet.idle:
 
-                case = pending_cases.pop(0)
+                case = pending_cases.popleft()
 
-                self.print(colored("Current Time: {}".format(current_time), "cyan", attrs=["bold"]))
-                self.print(colored("Processing pending case: {}".format(case.id), "green"))
+                if self.trace_dispatch:
+                    self.tracer.emit(CaseProcessed(current_time, case_id=case.id, status="pending"))
 
                 case_state_to_add = self.process_new_case(ambulances, case, current_time)
-                bisect.insort_left(ongoing_case_states, case_state_to_add)
+                ongoing_case_states.push(case_state_to_add.next_event_time, case_state_to_add)
+                changes.update([StateChange.PENDING_CASES, StateChange.AMBULANCES, StateChange.ONGOING_CASES])
 
             # Look at the next case
             elif next_case and next_case.date_recorded <= next_ongoing_case_state_dt:
 
                 current_time = next_case.date_recorded
-                self.print(colored("Current Time: {}".format(current_time), "cyan", attrs=["bold"]))
 
                 # Process a new case
-                if available_ambulances:
-                    self.print(colored("Processing new case: {}".format(next_case.id), "green", attrs=["bold"]))
+                if self.fleet.idle:
+                    if self.trace_dispatch:
+                        self.tracer.emit(CaseProcessed(current_time, case_id=next_case.id, status="new"))
                     case_state_to_add = self.process_new_case(ambulances, next_case, current_time)
-                    bisect.insort_left(ongoing_case_states, case_state_to_add)
+                    ongoing_case_states.push(case_state_to_add.next_event_time, case_state_to_add)
+                    changes.update([StateChange.AMBULANCES, StateChange.ONGOING_CASES])
 
                 # Delay a case
                 else:
-                    self.print(colored("New case arrived but no available ambulance; Case pending".format(), "red"))
+                    if self.trace_dispatch:
+                        self.tracer.emit(CaseProcessed(current_time, case_id=next_case.id, status="delayed"))
                     pending_cases.append(next_case)
+                    changes.add(StateChange.PENDING_CASES)
 
                 # Prepare the next case
                 next_case = next(case_iterator, None)
@@ -121,39 +153,44 @@ class EventDispatcherSimulator(Simulator):
             # Process an ongoing case event
             else:
 
-                next_ongoing_case_state = ongoing_case_states.pop(0)
+                next_ongoing_case_state = ongoing_case_states.pop()
                 current_time = next_ongoing_case_state.next_event_time
 
-                self.print(colored("Current Time: {}".format(current_time), "cyan", attrs=["bold"]))
-                self.print(colored("Processing ongoing case: {}".format(next_ongoing_case_state.case.id),
-                                   "green"))
+                if self.trace_event:
+                    self.tracer.emit(EventProcessed(current_time, case_id=next_ongoing_case_state.case.id))
 
                 # Process ongoing case
                 case_state_to_add, finished = self.process_ongoing_case(next_ongoing_case_state, current_time)
                 if not finished:
-                    bisect.insort_left(ongoing_case_states, case_state_to_add)
+                    ongoing_case_states.push(case_state_to_add.next_event_time, case_state_to_add)
                 else:
                     self.case_record_set.add_case_record(next_ongoing_case_state.case_record)
+                    changes.update([StateChange.AMBULANCES, StateChange.ONGOING_CASES])
 
-            self.print(colored("Busy ambulances: {}".format(sorted([amb.id for amb in ambulances if amb.deployed])),
-                               "yellow"))
-            self.print(colored("Ongoing cases: {}".format([case_state.case.id for case_state in ongoing_case_states]),
-                               "yellow"))
-            self.print(colored("Pending cases: {}".format([case.id for case in pending_cases]), "red"))
-            self.print("")
-            self.print(colored("Metrics", "magenta", attrs=["bold"]))
+            if current_time != previous_time:
+                changes.add(StateChange.TIME)
+
+            if self.trace_state:
+                self.tracer.emit(StateTraced(
+                    current_time,
+                    busy_ambulances=sorted([amb.id for amb in ambulances if amb.deployed]),
+                    ongoing_cases=[case_state.case.id for case_state in sorted(ongoing_case_states)],
+                    pending_cases=[case.id for case in pending_cases]))
 
             metric_kwargs = {"ambulances": ambulances,
-                             "ongoing_cases": [case_state.case for case_state in ongoing_case_states],
+                             "available_ambulances": self.fleet.idle,
+                             "ongoing_cases": [case_state.case for case_state in ongoing_case_states.ordered_items()],
                              "pending_cases": pending_cases}
 
             if self.metric_aggregator:
-                # Compute metrics
-                metrics = self.metric_aggregator.calculate(current_time, **metric_kwargs)
-                for metric_tag, value in metrics.items():
-                    self.print(colored("{}: {}".format(metric_tag, value), "magenta"))
+                # Compute the metrics depending on the state that changed
+                metrics = self.metric_aggregator.calculate(current_time, changes=changes, **metric_kwargs)
+
+                if self.trace_metric and metrics:
+                    self.tracer.emit(MetricsComputed(current_time, metrics=metrics))
 
-            self.print("=" * 80)
+        if self.tracer is not None:
+            self.tracer.close()
 
         return self.case_record_set
 
@@ -163,22 +200,18 @@ class EventDispatcherSimulator(Simulator):
 
         # Select an ambulance
         selected_ambulance = self.select_ambulance(ambulances, case, current_time)
-        selected_ambulance.deployed = True
+        self.fleet.deploy(selected_ambulance)
 
-        self.print("Selected ambulance: {}".format(selected_ambulance.id))
+        if self.trace_dispatch:
+            self.tracer.emit(AmbulanceSelected(current_time, case_id=case.id, ambulance_id=selected_ambulance.id))
 
         # Add new case to ongoing cases
         case_event_iterator = case.iterator(selected_ambulance, current_time)
         case_next_event = next(case_event_iterator)
         case_event_finish_datetime = current_time + case_next_event.duration
 
-        # TODO quite a bit of repeated code for self.print statements
-        self.print("Started new event: {}".format(case_next_event.event_type.value))
-        self.print(
-            "Destination: {}, {}".format(case_next_event.destination.latitude, case_next_event.destination.longitude))
-        self.print("Duration: {}".format(case_next_event.duration))
-        err = "{}%".format(round(case_next_event.error, 2)) if case_next_event.error else None
-        self.print("Distance Accuracy: {}".format(err))
+        if self.trace_event:
+            self.trace_event_started(current_time, case, case_next_event)
 
         case_record = CaseRecord(case=case,
                                  ambulance=selected_ambulance,
@@ -199,7 +232,10 @@ class EventDispatcherSimulator(Simulator):
         case_state.case_record.event_history.append(finished_event)
 
         # Perform event
-        self.print("Finished event: {}".format(finished_event.event_type.value))
+        if self.trace_event:
+            self.tracer.emit(EventFinished(current_time,
+                                           case_id=case_state.case.id,
+                                           event_type=finished_event.event_type.value))
         case_state.assigned_ambulance.location = finished_event.destination
 
         new_event = next(case_state.event_iterator, None)
@@ -207,13 +243,9 @@ class EventDispatcherSimulator(Simulator):
         # Generate new Case State pointing to the next event
         if new_event:
 
-            # TODO quite a bit of repeated code for self.print statements
             new_event_finish_datetime = current_time + new_event.duration
-            self.print("Started new event: {}".format(new_event.event_type.value))
-            self.print("Destination: {}, {}".format(new_event.destination.latitude, new_event.destination.longitude))
-            self.print("Duration: {}".format(new_event.duration))
-            err = "{}%".format(round(new_event.error, 2)) if new_event.error else None
-            self.print("Distance Difference: {}".format(err))
+            if self.trace_event:
+                self.trace_event_started(current_time, case_state.case, new_event)
 
             # Update case state with new info
             case_state.next_event_time = new_event_finish_datetime
@@ -223,17 +255,26 @@ class EventDispatcherSimulator(Simulator):
 
         # No more events
         else:
-            self.print(colored("Case finished", "green", attrs=["bold"]))
+            if self.trace_event:
+                self.tracer.emit(CaseFinished(current_time, case_id=case_state.case.id))
 
             # Free ambulance
-            case_state.assigned_ambulance.deployed = False
+            self.fleet.free(case_state.assigned_ambulance)
 
             return case_state, True
 
+    def trace_event_started(self, current_time: datetime, case: Case, event):
+        self.tracer.emit(EventStarted(current_time,
+                                      case_id=case.id,
+                                      event_type=event.event_type.value,
+                                      latitude=event.destination.latitude,
+                                      longitude=event.destination.longitude,
+                                      duration=event.duration,
+                                      error=event.error))
+
     # Selects an ambulance for the given case
     def select_ambulance(self, ambulances, case: Case, time: datetime):
-        available_ambulances = [amb for amb in ambulances if not amb.deployed]
-        selection = self.ambulance_selector.select_ambulance(available_ambulances, case, time)
+        selection = self.ambulance_selector.select_ambulance(self.fleet.idle, case, time)
         return selection
 
     def get_metrics(self):
@@ -0,0 +1,215 @@
+import json
+from collections import deque
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import List
+
+import numpy as np
+
+
+class TraceCategory(Enum):
+    DISPATCH = "dispatch"
+    EVENT = "event"
+    STATE = "state"
+    METRIC = "metric"
+
+
+def json_value(value):
+    """ Converts a traced value to a JSON value """
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+# Trace records. The simulator only builds a record when its category is traced.
+class TraceRecord:
+    category = None
+    fields = ()
+
+    def __init__(self, time: datetime, **kwargs):
+        self.time = time
+        for field in self.fields:
+            setattr(self, field, kwargs[field])
+
+    def to_dict(self):
+        d = {"type": type(self).__name__,
+             "category": self.category.value,
+             "time": self.time}
+        for field in self.fields:
+            d[field] = getattr(self, field)
+        return json_value(d)
+
+    def format(self):
+        raise NotImplementedError()
+
+
+class CaseProcessed(TraceRecord):
+    """ A case is dispatched from the new or pending cases, or delayed because no ambulance is available """
+    category = TraceCategory.DISPATCH
+    fields = ("case_id", "status")
+
+    def format(self):
+        if self.status == "delayed":
+            return "New case arrived but no available ambulance; Case pending"
+        return "Processing {} case: {}".format(self.status, self.case_id)
+
+
+class AmbulanceSelected(TraceRecord):
+    category = TraceCategory.DISPATCH
+    fields = ("case_id", "ambulance_id")
+
+    def format(self):
+        return "Selected ambulance: {}".format(self.ambulance_id)
+
+
+class EventProcessed(TraceRecord):
+    """ The next event of an ongoing case is due """
+    category = TraceCategory.EVENT
+    fields = ("case_id",)
+
+    def format(self):
+        return "Processing ongoing case: {}".format(self.case_id)
+
+
+class EventStarted(TraceRecord):
+    category = TraceCategory.EVENT
+    fields = ("case_id", "event_type", "latitude", "longitude", "duration", "error")
+
+    def format(self):
+        error = "{}%".format(round(self.error, 2)) if self.error else None
+        return "Started new event: {}\nDestination: {}, {}\nDuration: {}\nDistance Accuracy: {}".format(
+            self.event_type, self.latitude, self.longitude, self.duration, error)
+
+
+class EventFinished(TraceRecord):
+    category = TraceCategory.EVENT
+    fields = ("case_id", "event_type")
+
+    def format(self):
+        return "Finished event: {}".format(self.event_type)
+
+
+class CaseFinished(TraceRecord):
+    category = TraceCategory.EVENT
+    fields = ("case_id",)
+
+    def format(self):
+        return "Case finished"
+
+
+class StateTraced(TraceRecord):
+    category = TraceCategory.STATE
+    fields = ("busy_ambulances", "ongoing_cases", "pending_cases")
+
+    def format(self):
+        return "Busy ambulances: {}\nOngoing cases: {}\nPending cases: {}".format(
+            self.busy_ambulances, self.ongoing_cases, self.pending_cases)
+
+
+class MetricsComputed(TraceRecord):
+    category = TraceCategory.METRIC
+    fields = ("metrics",)
+
+    def format(self):
+        return "Metrics\n" + "\n".join("{}: {}".format(tag, value) for tag, value in self.metrics.items())
+
+
+# Interface for the destination of trace records
+class TraceSink:
+
+    def write(self, record: TraceRecord):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+# Pretty prints trace records to the terminal
+class TerminalTraceSink(TraceSink):
+
+    colors = {CaseProcessed: ("green", ["bold"]),
+              EventProcessed: ("green", []),
+              CaseFinished: ("green", ["bold"]),
+              StateTraced: ("yellow", []),
+              MetricsComputed: ("magenta", [])}
+
+    def __init__(self):
+        # TODO -- remove dependency on colored library
+        from termcolor import colored
+        self.colored = colored
+
+    def write(self, record: TraceRecord):
+
+        # A case or event being processed starts a new step of the simulation
+        if isinstance(record, (CaseProcessed, EventProcessed)):
+            print("=" * 80)
+            print(self.colored("Current Time: {}".format(record.time), "cyan", attrs=["bold"]))
+
+        text = record.format()
+        if type(record) in self.colors:
+            color, attrs = self.colors[type(record)]
+            text = self.colored(text, color, attrs=attrs)
+        print(text)
+
+
+# Writes trace records to a file as JSON lines
+class JsonLinesTraceSink(TraceSink):
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, 'w')
+
+    def write(self, record: TraceRecord):
+        self.file.write(json.dumps(record.to_dict()) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+# Keeps the latest trace records in memory
+class RingBufferTraceSink(TraceSink):
+
+    def __init__(self, capacity: int = 10000):
+        self.records = deque(maxlen=capacity)
+
+    def write(self, record: TraceRecord):
+        self.records.append(record)
+
+
+class Tracer:
+
+    def __init__(self,
+                 sinks: List[TraceSink],
+                 categories: List[str] = None):
+        """
+        :param sinks: Destinations of the trace records
+        :param categories: Names of the traced categories; all categories if None
+        """
+        self.sinks = sinks
+
+        if categories is None:
+            self.categories = set(TraceCategory)
+        else:
+            self.categories = set(TraceCategory(category) for category in categories)
+
+    def traces(self, category: TraceCategory):
+        return category in self.categories
+
+    def emit(self, record: TraceRecord):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -23,6 +23,22 @@ def parse_headered_csv (file: str, desired_keys: list):
     return raw[desired_keys]
 
 
+def parse_coordinates_csv (file: str, headers: list = None):
+    """
+    Takes a headered CSV file and extracts a latitude and a longitude column as arrays
+    :param file: CSV filename
+    :param headers: Names of the latitude and longitude columns
+    :return: numpy arrays of latitudes and longitudes
+    """
+
+    if headers is None:
+        headers = ["latitude", "longitude"]
+
+    raw = parse_headered_csv (file, headers)
+
+    return raw[headers[0]].to_numpy(dtype=float), raw[headers[1]].to_numpy(dtype=float)
+
+
 def parse_unheadered_csv (file: str, positions: list, header_names: list):
 
     """
@@ -1,4 +1,6 @@
-from ems.run import Driver
+from ems.artifacts import ArtifactCache
+from ems.profiling import Profiler
+from ems.run import Driver, ReplicationRunner
 
 
 if __name__ == "__main__":
@@ -18,15 +20,71 @@ if __name__ == "__main__":
                         type=str,
                         default=".")
 
+    parser.add_argument('--seeds',
+                        help="Run one independent replication per seed and summarize them with confidence intervals.",
+                        type=int,
+                        nargs='+',
+                        default=None)
+
+    parser.add_argument('--processes',
+                        help="Number of processes used to run replications; defaults to the number of CPUs.",
+                        type=int,
+                        default=None)
+
+    parser.add_argument('--profile',
+                        help="Time each phase of the simulation; prints a summary and writes profile.json.",
+                        action='store_true')
+
+    parser.add_argument('--cache-dir',
+                        help="Store the expensive objects built from the configuration, such as travel times and "
+                             "filtered bases, in this directory and restore them on later runs with the same inputs.",
+                        type=str,
+                        default=None)
+
+    parser.add_argument('--cache-size-mb',
+                        help="Evict the least recently used cached objects beyond this size.",
+                        type=float,
+                        default=None)
+
+    parser.add_argument('--clear-cache',
+                        help="Remove the cached objects before running.",
+                        action='store_true')
+
     # parse arguments
     args = parser.parse_args()
 
-    # create simulator
-    driver = Driver(args.config_file)
-    sim, data = driver.create_simulator()
+    artifact_cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_size_mb * 1024 * 1024) if args.cache_size_mb is not None else None
+        artifact_cache = ArtifactCache(args.cache_dir, max_bytes=max_bytes)
+        if args.clear_cache:
+            artifact_cache.invalidate()
+
+    if args.seeds:
+
+        # run replications
+        runner = ReplicationRunner(args.seeds, args.config_file, processes=args.processes,
+                                   artifact_cache=artifact_cache)
+        results = runner.run()
+
+        # Save the merged replication information
+        results.write_to_file(output_dir=args.output_dir)
+
+    else:
+
+        # create simulator
+        driver = Driver(args.config_file, artifact_cache=artifact_cache)
+        profiler = Profiler() if args.profile else None
+
+        # run simulator
+        sim, data = driver.run_simulator(profiler=profiler)
+
+        # Save the finished simulator information
+        sim.write_results(output_dir=args.output_dir)
 
-    # run simulator
-    sim.run()
+        if profiler is not None:
+            print(profiler.summary())
+            profiler.write_to_file(args.output_dir + '/profile.json')
 
-    # Save the finished simulator information
-    sim.write_results(output_dir=args.output_dir)
+        if artifact_cache is not None:
+            print("Artifact cache: {} restored, {} built".format(artifact_cache.hits, artifact_cache.misses))